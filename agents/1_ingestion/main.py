@@ -1,7 +1,14 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from pydantic import BaseModel
 
+from batching import as_model, map_batch, require_list
+import jsonio
+import metrics
+import tracing
+
 app = FastAPI(title="Ingestion Agent")
+metrics.instrument(app)
+tracing.instrument(app, "ingestion")
 
 # Define input schema
 class Shipment(BaseModel):
@@ -12,11 +19,6 @@ class Shipment(BaseModel):
     dispatch_ts: str
     expected_ts: str
 
-@app.get("/health")
-def health():
-    return {"status": "alive"}
-
-@app.post("/ingest")
 def ingest(shipment: Shipment):
     processed = {
         "shipment_id": shipment.shipment_id,
@@ -27,3 +29,22 @@ def ingest(shipment: Shipment):
         "expected_ts": shipment.expected_ts,
     }
     return {"processed": processed}
+
+def ingest_batch(shipments: list):
+    # Pure string work, so no thread pool; each record is validated on its own
+    return {"processed": map_batch(lambda s: ingest(as_model(Shipment, s))["processed"], shipments, max_workers=1)}
+
+@app.get("/health")
+def health():
+    return {"status": "alive"}
+
+@app.post("/ingest")
+def ingest_endpoint(shipment: Shipment):
+    return ingest(shipment)
+
+@app.post("/ingest_batch")
+async def ingest_batch_endpoint(request: Request):
+    shipments = require_list(await jsonio.read_json(request))
+    before = jsonio.snapshot(request, shipments)
+    results = ingest_batch(shipments)
+    return jsonio.response({"processed": jsonio.delta(before, results["processed"])})
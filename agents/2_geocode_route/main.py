@@ -1,11 +1,57 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-import requests, os
+import os
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 load_dotenv()
 
+import http_client
+from batching import as_model, map_batch, require_list
+import jsonio
+import metrics
+from cache import LRUCache, SQLiteStore, TieredCache
+import tracing
+import polyline
+from single_flight import SingleFlight
+
 app = FastAPI(title="Shipment Enrichment Agent")
+metrics.instrument(app)
+tracing.instrument(app, "geocode")
 API_KEY = os.getenv("TOMTOM")
+TOMTOM_BASE_URL = os.getenv("TOMTOM_BASE_URL", "https://api.tomtom.com").rstrip("/")
+
+# Geocode cache: memory LRU in front of SQLite. Set GEOCODE_CACHE_PATH="" to keep it in memory only.
+GEOCODE_CACHE_PATH = os.getenv(
+    "GEOCODE_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "geocode_cache.db")
+)
+GEOCODE_CACHE_TTL = float(os.getenv("GEOCODE_CACHE_TTL", str(30 * 86400)))
+geocode_cache = TieredCache(
+    LRUCache(maxsize=int(os.getenv("GEOCODE_CACHE_SIZE", "2048")), ttl=GEOCODE_CACHE_TTL),
+    SQLiteStore(
+        GEOCODE_CACHE_PATH, "geocode", ttl=GEOCODE_CACHE_TTL,
+        max_rows=int(os.getenv("GEOCODE_CACHE_DISK_SIZE", "100000")),
+    ) if GEOCODE_CACHE_PATH else None,
+)
+
+# Route cache: lanes are keyed on coordinates rounded to ROUTE_KEY_DECIMALS (3 = ~100 m).
+# With ROUTE_TIME_BUCKET_HOURS > 0 the key also carries the dispatch time bucket and
+# TomTom is asked for travel time at that departure (when it is in the future).
+ROUTE_CACHE_TTL = float(os.getenv("ROUTE_CACHE_TTL", str(12 * 3600)))
+ROUTE_KEY_DECIMALS = int(os.getenv("ROUTE_KEY_DECIMALS", "3"))
+ROUTE_TIME_BUCKET_HOURS = float(os.getenv("ROUTE_TIME_BUCKET_HOURS", "0"))
+route_cache = TieredCache(
+    LRUCache(maxsize=int(os.getenv("ROUTE_CACHE_SIZE", "1024")), ttl=ROUTE_CACHE_TTL),
+    SQLiteStore(
+        GEOCODE_CACHE_PATH, "route", ttl=ROUTE_CACHE_TTL,
+        max_rows=int(os.getenv("ROUTE_CACHE_DISK_SIZE", "20000")),
+    ) if GEOCODE_CACHE_PATH else None,
+)
+# Concurrent lookups for the same city or lane share one TomTom call
+geocode_flight = SingleFlight("geocode")
+route_flight = SingleFlight("route")
+metrics.track_stats("geocode_cache", geocode_cache.stats)
+metrics.track_stats("route_cache", route_cache.stats)
 
 # ---------------------------
 # Pydantic models
@@ -21,10 +67,28 @@ class Shipment(BaseModel):
 # ---------------------------
 # Helper functions
 # ---------------------------
+def normalize_city(city_name: str) -> str:
+    return " ".join(city_name.split()).upper()
+
+
 def get_coords_tomtom(city_name: str):
-    url = f"https://api.tomtom.com/search/2/geocode/{city_name}.json"
+    key = normalize_city(city_name)
+    cached = geocode_cache.get(key)
+    if cached is not None:
+        return cached
+    return geocode_flight.do(key, lambda: _fetch_and_cache_coords(key))
+
+
+def _fetch_and_cache_coords(key: str) -> dict:
+    coords = fetch_coords_tomtom(key)
+    geocode_cache.set(key, coords)
+    return coords
+
+
+def fetch_coords_tomtom(city_name: str):
+    url = f"{TOMTOM_BASE_URL}/search/2/geocode/{city_name}.json"
     params = {"key": API_KEY, "limit": 1}
-    resp = requests.get(url, params=params)
+    resp = http_client.get(url, params=params)
     if resp.status_code != 200:
         raise HTTPException(status_code=500, detail=f"TomTom geocode error: {resp.text}")
 
@@ -36,9 +100,50 @@ def get_coords_tomtom(city_name: str):
     return {"lon": pos["lon"], "lat": pos["lat"]}
 
 
-def get_route_tomtom(origin: dict, dest: dict):
+def departure_bucket(dispatch_ts: str | None) -> datetime | None:
+    """Start of the dispatch time bucket, or None when bucketing is off or the time is unusable."""
+    if ROUTE_TIME_BUCKET_HOURS <= 0 or not dispatch_ts:
+        return None
+    try:
+        ts = datetime.fromisoformat(dispatch_ts.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    if ts <= datetime.now(timezone.utc):
+        return None  # TomTom only accepts future departures; use live traffic
+    size = ROUTE_TIME_BUCKET_HOURS * 3600
+    return datetime.fromtimestamp(ts.timestamp() // size * size, tz=timezone.utc)
+
+
+def route_key(origin: dict, dest: dict, depart_at: datetime | None) -> str:
+    r = ROUTE_KEY_DECIMALS
+    lane = (
+        f"{round(origin['lat'], r)},{round(origin['lon'], r)}:"
+        f"{round(dest['lat'], r)},{round(dest['lon'], r)}"
+    )
+    return f"{lane}@{depart_at.isoformat()}" if depart_at else lane
+
+
+def get_route_tomtom(origin: dict, dest: dict, depart_at: datetime | None = None):
+    """(encoded polyline of the whole route, metres, seconds)."""
+    key = route_key(origin, dest, depart_at)
+    cached = route_cache.get(key)
+    if cached is None:
+        cached = route_flight.do(key, lambda: _fetch_and_cache_route(key, origin, dest, depart_at))
+    return cached["polyline"], cached["distance"], cached["duration"]
+
+
+def _fetch_and_cache_route(key: str, origin: dict, dest: dict, depart_at: datetime | None) -> dict:
+    coords, distance, duration = fetch_route_tomtom(origin, dest, depart_at)
+    route = {"polyline": polyline.encode(coords), "distance": distance, "duration": duration}
+    route_cache.set(key, route)
+    return route
+
+
+def fetch_route_tomtom(origin: dict, dest: dict, depart_at: datetime | None = None):
     url = (
-        f"https://api.tomtom.com/routing/1/calculateRoute/"
+        f"{TOMTOM_BASE_URL}/routing/1/calculateRoute/"
         f"{origin['lat']},{origin['lon']}:{dest['lat']},{dest['lon']}/json"
     )
     params = {
@@ -47,8 +152,10 @@ def get_route_tomtom(origin: dict, dest: dict):
         "routeRepresentation": "polyline",
         "computeTravelTimeFor": "all",
     }
+    if depart_at is not None:
+        params["departAt"] = depart_at.strftime("%Y-%m-%dT%H:%M:%SZ")
 
-    resp = requests.get(url, params=params)
+    resp = http_client.get(url, params=params)
     if resp.status_code != 200:
         raise HTTPException(status_code=500, detail=f"TomTom route error: {resp.text}")
 
@@ -71,7 +178,7 @@ def enrich(shipment: Shipment) -> dict:
     except Exception as e:
         return {**shipment.dict(), "geocode_ok": False, "error": str(e)}
 
-    route, distance, duration = get_route_tomtom(ocoord, dcoord)
+    route, distance, duration = get_route_tomtom(ocoord, dcoord, departure_bucket(shipment.dispatch_ts))
 
     enriched = shipment.dict()
     enriched.update(
@@ -83,19 +190,36 @@ def enrich(shipment: Shipment) -> dict:
             "dest_lon": dcoord["lon"],
             "distance_km": round(distance / 1000, 2),
             "duration_hr": round(duration / 3600, 2),
-            "route_points": route[:10],  # sample first 10
+            "route_polyline": route,  # whole route, see polyline.py
         }
     )
     return enriched
 
+
+def enrich_batch(shipments: list) -> list[dict]:
+    # Each record is validated on its own, so one bad record fails only itself
+    return map_batch(lambda s: enrich(as_model(Shipment, s)), shipments)
+
 # ---------------------------
 # API Endpoints
 # ---------------------------
 @app.get("/health")
 def health():
-    return {"status": "alive"}
+    return {
+        "status": "alive",
+        "geocode_cache": geocode_cache.stats(),
+        "route_cache": route_cache.stats(),
+        "single_flight": {"geocode": geocode_flight.stats(), "route": route_flight.stats()},
+    }
 
 @app.post("/geocode_enrich")
 def enrich_endpoint(shipment: Shipment):
-    return enrich(shipment)
+    return jsonio.response(enrich(shipment))
+
+@app.post("/geocode_enrich_batch")
+async def enrich_batch_endpoint(request: Request):
+    shipments = require_list(await jsonio.read_json(request))
+    before = jsonio.snapshot(request, shipments)
+    results = await run_in_threadpool(enrich_batch, shipments)
+    return jsonio.response(jsonio.delta(before, results))
 
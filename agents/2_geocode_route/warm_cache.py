@@ -0,0 +1,35 @@
+"""Preload the geocode cache with a list of cities.
+
+    python warm_cache.py NAIROBI MOMBASA KISUMU
+    python warm_cache.py --file cities.txt      # one city per line
+"""
+import argparse
+
+from main import geocode_cache, get_coords_tomtom
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preload the geocode cache")
+    parser.add_argument("cities", nargs="*", help="city names to geocode")
+    parser.add_argument("--file", help="text file with one city name per line")
+    args = parser.parse_args()
+
+    cities = list(args.cities)
+    if args.file:
+        with open(args.file) as f:
+            cities += [line.strip() for line in f if line.strip()]
+
+    failed = []
+    for city in cities:
+        try:
+            get_coords_tomtom(city)
+        except Exception as e:
+            failed.append(city)
+            print(f"{city}: {getattr(e, 'detail', e)}")
+
+    print(f"Warmed {len(cities) - len(failed)}/{len(cities)} cities")
+    print(geocode_cache.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Fast JSON in and out of the services, and the slim batch payload contract.
+
+Copied by scripts/sync_shared.py into the orchestrator and every agent; edit
+shared/jsonio.py.
+
+    shipments = await jsonio.read_json(request)     # orjson instead of request.json()
+    before = jsonio.snapshot(request, shipments)
+    results = enrich_batch(shipments)
+    return jsonio.response(jsonio.delta(before, results))
+
+Uses orjson when it is installed and falls back to the standard library.
+`response()` returns the encoded bytes directly, skipping FastAPI's
+jsonable_encoder pass over the whole result.
+
+Slim payloads: the orchestrator sends each stage only the fields it reads
+and sets the DELTA_HEADER, asking for only the fields the stage added or
+changed (plus shipment_id, and stage_error entries as they are). It merges
+those into its own copy of the record. Callers without the header get the
+whole shipment back as before.
+"""
+import json
+
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DELTA_HEADER = "X-CargoSense-Delta"
+
+
+def _default(value):
+    # NumPy scalars and pydantic models show up in agent results
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if hasattr(value, "dict"):
+        return value.dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj, default=_default, option=_OPTIONS)
+
+    loads = orjson.loads
+else:
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, default=_default, separators=(",", ":")).encode()
+
+    loads = json.loads
+
+
+async def read_json(request):
+    return loads(await request.body())
+
+
+def response(obj, status_code: int = 200) -> Response:
+    return Response(content=dumps(obj), status_code=status_code, media_type="application/json")
+
+
+def snapshot(request, shipments: list) -> list | None:
+    """Shallow copies of the input records if the caller asked for deltas, else None.
+
+    Taken before the stage runs, since most stages update the records in place.
+    """
+    if request.headers.get(DELTA_HEADER) != "1" or not isinstance(shipments, list):
+        return None
+    return [_copy(s) for s in shipments]
+
+
+def _copy(item) -> dict | None:
+    # dict() also works on pydantic models (field name, value pairs)
+    try:
+        return dict(item)
+    except (TypeError, ValueError):
+        return None
+
+
+def delta(before: list | None, results: list) -> list:
+    """Per result, only the fields that are new or changed compared to its input."""
+    if before is None:
+        return results
+    slim = []
+    for old, new in zip(before, results):
+        if old is None or not isinstance(new, dict) or "stage_error" in new:
+            slim.append(new)
+            continue
+        changed = {"shipment_id": new.get("shipment_id", old.get("shipment_id"))}
+        for key, value in new.items():
+            if key not in old or (old[key] is not value and old[key] != value):
+                changed[key] = value
+        slim.append(changed)
+    return slim
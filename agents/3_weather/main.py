@@ -1,11 +1,41 @@
-import requests
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 from fastapi import FastAPI, Request
+from starlette.concurrency import run_in_threadpool
+
+import http_client
+from batching import map_batch
+import jsonio
+import metrics
+import polyline
+from single_flight import SingleFlight
+import tracing
+from weather_tiles import CorridorPrefetcher, TileStore, geohash, geohash_center
 # from pydantic import BaseModel
 
-OPEN_METEO_URL = "https://api.open-meteo.com/v1/forecast"
+OPEN_METEO_URL = os.getenv("OPEN_METEO_URL", "https://api.open-meteo.com/v1/forecast")
+
+# Points are mapped to geohash cells (precision 4 = ~39 x 20 km) so nearby
+# points, within one shipment or across shipments, share one forecast tile
+WEATHER_GEOHASH_PRECISION = int(os.getenv("WEATHER_GEOHASH_PRECISION", "4"))
+# Locations per multi-location Open-Meteo request
+WEATHER_MAX_LOCATIONS = int(os.getenv("WEATHER_MAX_LOCATIONS", "100"))
+# Optional JSON file the tiles are persisted to
+WEATHER_TILE_PATH = os.getenv("WEATHER_TILE_PATH") or None
+# Background prefetch of the WEATHER_PREFETCH_TOP busiest corridors (0 disables it)
+WEATHER_PREFETCH_TOP = int(os.getenv("WEATHER_PREFETCH_TOP", "20"))
+WEATHER_PREFETCH_INTERVAL = float(os.getenv("WEATHER_PREFETCH_INTERVAL", "300"))
 
 app = FastAPI(title="Weather Enrichment Agent")
+metrics.instrument(app)
+tracing.instrument(app, "weather")
+tiles = TileStore(WEATHER_TILE_PATH)
+metrics.track_stats("weather_tiles", tiles.stats)
+# Cells another request is already fetching are waited for, not fetched again
+weather_flight = SingleFlight("weather")
 
 
 # ---------------------------
@@ -17,42 +47,117 @@ def sample_route(lat1, lon1, lat2, lon2, n_points=5):
     lons = np.linspace(lon1, lon2, n_points)
     return list(zip(lats, lons))
 
-def get_weather(lat, lon, timeout=5):
-    try:
-        params = {
-            "latitude": lat,
-            "longitude": lon,
-            "hourly": "precipitation,wind_speed_10m",
-            "forecast_days": 1,
-        }
-        resp = requests.get(OPEN_METEO_URL, params=params, timeout=timeout)
-        resp.raise_for_status()
-        data = resp.json()
-        # Take simple daily max for quick risk scoring
-        rain = max(data["hourly"]["precipitation"])
-        wind = max(data["hourly"]["wind_speed_10m"])
-        return rain, wind
-    except Exception:
-        return 0.0, 0.0
-
-
-def enrich_weather(shipment, n_samples=5) -> dict:
-    # Use precomputed ORS route if available
-    if shipment["route_points"]:
+def snap(lat, lon):
+    return geohash(float(lat), float(lon), WEATHER_GEOHASH_PRECISION)
+
+def _daily_max(hourly: dict):
+    # Take simple daily max for quick risk scoring
+    return max(hourly["precipitation"]), max(hourly["wind_speed_10m"])
+
+def fetch_weather(lat, lon, timeout=5):
+    params = {
+        "latitude": lat,
+        "longitude": lon,
+        "hourly": "precipitation,wind_speed_10m",
+        "forecast_days": 1,
+    }
+    resp = http_client.get(OPEN_METEO_URL, params=params, timeout=timeout)
+    resp.raise_for_status()
+    return _daily_max(resp.json()["hourly"])
+
+def fetch_weather_many(cells: list, timeout=5) -> dict:
+    """Fetch several cells in one Open-Meteo call (comma-separated cell centres)."""
+    centers = [geohash_center(cell) for cell in cells]
+    params = {
+        "latitude": ",".join(str(lat) for lat, _ in centers),
+        "longitude": ",".join(str(lon) for _, lon in centers),
+        "hourly": "precipitation,wind_speed_10m",
+        "forecast_days": 1,
+    }
+    resp = http_client.get(OPEN_METEO_URL, params=params, timeout=timeout)
+    resp.raise_for_status()
+    data = resp.json()
+    # A single location comes back as an object, several as a list in request order
+    locations = data if isinstance(data, list) else [data]
+    if len(locations) != len(cells):
+        raise ValueError(f"Open-Meteo returned {len(locations)} locations for {len(cells)}")
+    return {cell: _daily_max(loc["hourly"]) for cell, loc in zip(cells, locations)}
+
+def _fetch_each(cells: list) -> dict:
+    """Fallback: one request per cell, all in flight at once. Failures are left out."""
+    def fetch(cell):
+        try:
+            return cell, fetch_weather(*geohash_center(cell))
+        except Exception:
+            return cell, None
+
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=min(len(cells), 16)) as pool:
+        results = pool.map(lambda cell: context.copy().run(fetch, cell), cells)
+        return {cell: value for cell, value in results if value is not None}
+
+def fetch_cells(cells: list) -> dict:
+    """Fetch cells in multi-location requests; cells that cannot be fetched are left out."""
+    fetched = {}
+    for i in range(0, len(cells), WEATHER_MAX_LOCATIONS):
+        chunk = cells[i:i + WEATHER_MAX_LOCATIONS]
+        try:
+            fetched.update(fetch_weather_many(chunk))
+        except Exception as e:
+            print(f"Open-Meteo multi-location request failed, fetching points one by one: {e}")
+            fetched.update(_fetch_each(chunk))
+    return fetched
+
+def _fetch_and_store(cells: list) -> dict:
+    fetched = fetch_cells(cells)
+    tiles.set_many(fetched)
+    return fetched
+
+def fetch_cells_shared(cells: list) -> dict:
+    """fetch_cells for the cells nobody is fetching yet; the rest come from the calls in flight."""
+    return weather_flight.do_many(cells, _fetch_and_store)
+
+def weather_for_cells(cells) -> dict:
+    """(rain, wind) for every cell: tile store first, then one multi-location request for the rest."""
+    cells = list(dict.fromkeys(cells))
+    found, missing = tiles.get_many(cells)
+    fetched = fetch_cells_shared(missing) if missing else {}
+
+    found.update(fetched)
+    # Points whose forecast could not be fetched count as dry and calm (not cached)
+    return {cell: found.get(cell, (0.0, 0.0)) for cell in cells}
+
+def route_cells(shipment, n_samples=5) -> list:
+    # Use the route if available: points evenly spaced along the road
+    if shipment.get("route_polyline"):
+        points = polyline.sample(shipment["route_polyline"], n_samples)
+    elif shipment.get("route_points"):
         step = max(1, len(shipment["route_points"]) // n_samples)
         points = shipment["route_points"][::step][:n_samples]
     else:
         points = sample_route(
-            shipment.origin_lat, shipment.origin_lon,
-            shipment.dest_lat, shipment.dest_lon,
+            shipment["origin_lat"], shipment["origin_lon"],
+            shipment["dest_lat"], shipment["dest_lon"],
             n_points=n_samples,
         )
+    return [snap(lat, lon) for lat, lon in points]
+
+
+prefetcher = CorridorPrefetcher(
+    tiles, fetch_cells_shared, interval=WEATHER_PREFETCH_INTERVAL, top_k=WEATHER_PREFETCH_TOP
+)
 
-    rains, winds = [], []
-    for lat, lon in points:
-        rain, wind = get_weather(lat, lon)
-        rains.append(rain)
-        winds.append(wind)
+
+def enrich_weather(shipment, n_samples=5, known: dict | None = None) -> dict:
+    """known: (rain, wind) per cell already looked up, e.g. by enrich_weather_batch."""
+    cells = route_cells(shipment, n_samples)
+    prefetcher.record(cells)
+    weather = {cell: known[cell] for cell in cells if cell in known} if known else {}
+    missing = [cell for cell in cells if cell not in weather]
+    if missing:
+        weather.update(weather_for_cells(missing))
+    rains = [rain for rain, _ in weather.values()]
+    winds = [wind for _, wind in weather.values()]
 
     max_rain, max_wind = max(rains), max(winds)
     storm = int(max_rain > 15 and max_wind > 35)
@@ -66,15 +171,50 @@ def enrich_weather(shipment, n_samples=5) -> dict:
     return enriched
 
 
+def enrich_weather_batch(shipments: list[dict]) -> list[dict]:
+    # Fetch every cell of the batch up front so shared cells cost one lookup
+    cells = []
+    for shipment in shipments:
+        try:
+            cells.extend(route_cells(shipment))
+        except Exception:
+            pass  # reported per shipment by map_batch below
+    known = weather_for_cells(cells) if cells else {}
+    return map_batch(lambda s: enrich_weather(s, known=known), shipments)
+
+
 # ---------------------------
 # API Endpoints
 # ---------------------------
+@app.on_event("startup")
+def start_prefetch():
+    if WEATHER_PREFETCH_TOP > 0:
+        prefetcher.start()
+
+
+@app.on_event("shutdown")
+def stop_prefetch():
+    prefetcher.stop()
+
+
 @app.get("/health")
 def health():
-    return {"status": "alive"}
+    return {
+        "status": "alive",
+        "weather_tiles": {**tiles.stats(), "prefetched": prefetcher.prefetched},
+        "single_flight": weather_flight.stats(),
+    }
 
 
 @app.post("/enrich_weather")
 async def enrich_weather_endpoint(request: Request):
-    shipment = await request.json()
-    return enrich_weather(shipment)
+    shipment = await jsonio.read_json(request)
+    return jsonio.response(await run_in_threadpool(enrich_weather, shipment))
+
+
+@app.post("/enrich_weather_batch")
+async def enrich_weather_batch_endpoint(request: Request):
+    shipments = await jsonio.read_json(request)
+    before = jsonio.snapshot(request, shipments)
+    results = await run_in_threadpool(enrich_weather_batch, shipments)
+    return jsonio.response(jsonio.delta(before, results))
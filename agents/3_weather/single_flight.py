@@ -0,0 +1,116 @@
+"""Single-flight: concurrent lookups for the same key share one upstream call.
+
+Copied by scripts/sync_shared.py into the geocode, weather and traffic agents;
+edit shared/single_flight.py.
+
+    coords_flight = SingleFlight("geocode")
+    coords = coords_flight.do(city, lambda: fetch_coords(city))
+
+The first caller for a key runs the lookup; callers arriving while it runs
+wait for it and get its result (or its exception). Nothing is kept once the
+call returns, so this sits in front of a cache rather than replacing one:
+it covers the burst before the cache is warm, e.g. a batch with many
+shipments from the same city.
+
+Every call and every collapsed call is counted per flight in
+`single_flight_calls_total` / `single_flight_collapsed_total` on /metrics.
+"""
+import threading
+
+import metrics
+
+CALLS = metrics.counter("single_flight_calls_total", "Lookups that went through a single-flight group", ("flight",))
+COLLAPSED = metrics.counter(
+    "single_flight_collapsed_total", "Lookups that waited for an identical call already in flight", ("flight",)
+)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.collapsed = 0
+
+    def _join(self, keys) -> tuple[list, list]:
+        """Split keys into (key, call) pairs this caller leads and ones already in flight."""
+        led, waiting = [], []
+        with self._lock:
+            for key in keys:
+                call = self._calls.get(key)
+                if call is None:
+                    call = self._calls[key] = _Call()
+                    led.append((key, call))
+                else:
+                    waiting.append((key, call))
+            self.calls += len(led) + len(waiting)
+            self.collapsed += len(waiting)
+        CALLS.inc(len(led) + len(waiting), flight=self.name)
+        if waiting:
+            COLLAPSED.inc(len(waiting), flight=self.name)
+        return led, waiting
+
+    def _finish(self, led: list, values: dict | None = None, error: Exception | None = None):
+        with self._lock:
+            for key, call in led:
+                del self._calls[key]
+        for key, call in led:
+            call.value = values.get(key) if values is not None else None
+            call.error = error
+            call.done.set()
+
+    @staticmethod
+    def _wait(call: _Call):
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.value
+
+    def do(self, key, fn):
+        """fn() for the first caller with this key; the result for everyone calling meanwhile."""
+        led, waiting = self._join([key])
+        if waiting:
+            return self._wait(waiting[0][1])
+        try:
+            value = fn()
+        except Exception as e:
+            self._finish(led, error=e)
+            raise
+        self._finish(led, {key: value})
+        return value
+
+    def do_many(self, keys: list, fn) -> dict:
+        """{key: value} for several keys at once, e.g. one multi-location request.
+
+        fn(keys) is called with only the keys nobody else is fetching and returns
+        {key: value}; keys it leaves out are left out of the result. The other
+        keys are waited for.
+        """
+        led, waiting = self._join(dict.fromkeys(keys))
+        values = {}
+        if led:
+            try:
+                values = fn([key for key, _ in led])
+            except Exception as e:
+                self._finish(led, error=e)
+                raise
+            self._finish(led, values)
+        results = {key: values[key] for key, _ in led if key in values}
+        for key, call in waiting:
+            value = self._wait(call)
+            if value is not None:
+                results[key] = value
+        return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = len(self._calls)
+        return {"calls": self.calls, "collapsed": self.collapsed, "in_flight": in_flight}
@@ -0,0 +1,207 @@
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def current_hour() -> int:
+    return int(time.time() // 3600)
+
+
+def geohash(lat: float, lon: float, precision: int = 4) -> str:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    bits, bit_count, even = 0, 0, True
+    out = []
+    while len(out) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            out.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(out)
+
+
+def geohash_center(cell: str) -> tuple[float, float]:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in cell:
+        bits = _BASE32.index(char)
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (bits >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return (
+        round((lat_range[0] + lat_range[1]) / 2, 5),
+        round((lon_range[0] + lon_range[1]) / 2, 5),
+    )
+
+
+class TileStore:
+    """(rain, wind) per geohash cell and forecast hour.
+
+    Only the current hour's tiles are served; older hours are dropped as the
+    clock moves on. With a `path`, tiles are saved as JSON and reloaded on
+    start, so a restart within the hour keeps them.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._tiles = {}
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            self.load()
+
+    def _prune(self, hour: int):
+        for key in [k for k in self._tiles if k[1] < hour]:
+            del self._tiles[key]
+
+    def get_many(self, cells) -> tuple[dict, list]:
+        """Split cells into (cached values, cells still to fetch)."""
+        hour = current_hour()
+        found, missing = {}, []
+        with self._lock:
+            for cell in cells:
+                value = self._tiles.get((cell, hour))
+                if value is not None:
+                    found[cell] = value
+                else:
+                    missing.append(cell)
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def missing(self, cells) -> list:
+        """Cells without a tile for the current hour, without touching the hit counters."""
+        hour = current_hour()
+        with self._lock:
+            return [cell for cell in cells if (cell, hour) not in self._tiles]
+
+    def set_many(self, values: dict):
+        hour = current_hour()
+        with self._lock:
+            self._prune(hour)
+            for cell, value in values.items():
+                self._tiles[(cell, hour)] = tuple(value)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            tiles = [[cell, hour, list(value)] for (cell, hour), value in self._tiles.items()]
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(tiles, f)
+        os.replace(tmp, self.path)
+
+    def load(self):
+        hour = current_hour()
+        try:
+            with open(self.path) as f:
+                tiles = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not load weather tiles from {self.path}: {e}")
+            return
+        with self._lock:
+            for cell, tile_hour, value in tiles:
+                if tile_hour >= hour:
+                    self._tiles[(cell, tile_hour)] = tuple(value)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "tiles": len(self._tiles),
+        }
+
+
+class CorridorPrefetcher:
+    """Keeps tiles for the most frequently seen corridors warm.
+
+    Every shipment's route cells are recorded under its (first cell, last cell)
+    corridor. A background thread periodically fetches any tiles of the top
+    corridors that are missing for the current hour, so they are in place
+    before the next shipment on that lane asks. Counts are halved every hour
+    so the ranking follows recent traffic.
+    """
+
+    def __init__(self, store: TileStore, fetch, interval: float = 300.0, top_k: int = 20):
+        self.store = store
+        self.fetch = fetch  # fetch(cells) -> {cell: (rain, wind)}
+        self.interval = interval
+        self.top_k = top_k
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._cells = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._decayed_hour = current_hour()
+        self.prefetched = 0
+
+    def record(self, cells: list):
+        if not cells:
+            return
+        corridor = (cells[0], cells[-1])
+        with self._lock:
+            self._counts[corridor] += 1
+            self._cells[corridor] = list(dict.fromkeys(cells))
+
+    def hot_cells(self) -> list:
+        with self._lock:
+            corridors = [c for c, _ in self._counts.most_common(self.top_k)]
+            cells = [cell for c in corridors for cell in self._cells[c]]
+        return list(dict.fromkeys(cells))
+
+    def refresh(self):
+        missing = self.store.missing(self.hot_cells())
+        if missing:
+            fetched = self.fetch(missing)
+            self.store.set_many(fetched)
+            self.prefetched += len(fetched)
+        hour = current_hour()
+        if hour != self._decayed_hour:
+            self._decayed_hour = hour
+            with self._lock:
+                for corridor in list(self._counts):
+                    self._counts[corridor] //= 2
+                    if not self._counts[corridor]:
+                        del self._counts[corridor], self._cells[corridor]
+        self.store.save()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Weather prefetch failed: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="weather-prefetch", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.store.save()
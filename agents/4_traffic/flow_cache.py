@@ -0,0 +1,43 @@
+import threading
+import time
+
+
+class TTLCache:
+    """Thread-safe dict whose entries expire `ttl` seconds after being set."""
+
+    def __init__(self, ttl: float = 120.0, maxsize: int = 10_000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] > time.time():
+                self.hits += 1
+                return item[0]
+            self._data.pop(key, None)
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            if len(self._data) >= self.maxsize:
+                # Drop expired entries first, then the oldest ones
+                self._data = {k: v for k, v in self._data.items() if v[1] > now}
+                while len(self._data) >= self.maxsize:
+                    del self._data[next(iter(self._data))]
+            self._data[key] = (value, now + self.ttl)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "size": len(self._data),
+        }
@@ -1,15 +1,46 @@
 from fastapi import FastAPI, Request
-import requests, os
+from starlette.concurrency import run_in_threadpool
+import os
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 load_dotenv()
 
+import http_client
+from batching import map_batch
+import jsonio
+import metrics
+from flow_cache import TTLCache
+import polyline
+from single_flight import SingleFlight
+import tracing
+
 app = FastAPI()
+metrics.instrument(app)
+tracing.instrument(app, "traffic")
 TOMTOM_KEY = os.getenv("TOMTOM")
+TOMTOM_BASE_URL = os.getenv("TOMTOM_BASE_URL", "https://api.tomtom.com").rstrip("/")
+
+# Flow lookups for one shipment run concurrently; whatever has arrived after
+# TRAFFIC_DEADLINE seconds is averaged and slower lookups are not waited for
+TRAFFIC_DEADLINE = float(os.getenv("TRAFFIC_DEADLINE", "3"))
+# Points are snapped to TRAFFIC_SNAP_DECIMALS (3 = ~100 m) and cached for TRAFFIC_CACHE_TTL seconds
+TRAFFIC_SNAP_DECIMALS = int(os.getenv("TRAFFIC_SNAP_DECIMALS", "3"))
+flow_cache = TTLCache(ttl=float(os.getenv("TRAFFIC_CACHE_TTL", "120")))
+metrics.track_stats("traffic_flow", flow_cache.stats)
+# Shared pool so lookups that miss the deadline can finish (and fill the cache) in the background
+flow_pool = ThreadPoolExecutor(max_workers=int(os.getenv("TRAFFIC_WORKERS", "32")))
+# Shipments sampling the same point at once share one TomTom flow call
+traffic_flight = SingleFlight("traffic")
+# Lookups still running when their shipment's deadline passed (batch threads update it)
+late_lookups = 0
+late_lookups_lock = threading.Lock()
 
-def get_traffic_flow(lat, lon):
-    url = "https://api.tomtom.com/traffic/services/4/flowSegmentData/absolute/10/json"
+def get_traffic_flow(lat, lon, timeout=None):
+    url = f"{TOMTOM_BASE_URL}/traffic/services/4/flowSegmentData/absolute/10/json"
     params = {"point": f"{lat},{lon}", "key": TOMTOM_KEY}
-    resp = requests.get(url, params=params)
+    resp = http_client.get(url, params=params, timeout=timeout or TRAFFIC_DEADLINE)
     if resp.status_code == 200:
         data = resp.json()["flowSegmentData"]
         current = data["currentSpeed"]
@@ -19,33 +50,84 @@ def get_traffic_flow(lat, lon):
     return None
 
 
-def enrich_congestion(shipment, n_samples=3):
-    points = shipment.get("route_points", [])
-    if not points:
-        return shipment
-    
-    step = max(1, len(points) // n_samples)
-    subsampled = points[::step][:n_samples]
+def snap(lat, lon):
+    return round(lat, TRAFFIC_SNAP_DECIMALS), round(lon, TRAFFIC_SNAP_DECIMALS)
+
+
+def cached_traffic_flow(point):
+    return traffic_flight.do(point, lambda: _fetch_and_cache_flow(point))
+
+
+def _fetch_and_cache_flow(point):
+    score = get_traffic_flow(*point)
+    if score is not None:
+        flow_cache.set(point, score)
+    return score
+
 
-    scores = []
-    for lat, lon in subsampled:
-        score = get_traffic_flow(lat, lon)
+def congestion_scores(points, deadline=None) -> list[float]:
+    """Congestion for each point, from cache or fetched concurrently within the deadline."""
+    global late_lookups
+    scores, pending = [], []
+    for point in dict.fromkeys(snap(lat, lon) for lat, lon in points):
+        score = flow_cache.get(point)
         if score is not None:
             scores.append(score)
+        else:
+            pending.append(flow_pool.submit(contextvars.copy_context().run, cached_traffic_flow, point))
+
+    if pending:
+        done, not_done = wait(pending, timeout=deadline or TRAFFIC_DEADLINE)
+        with late_lookups_lock:
+            late_lookups += len(not_done)
+        for future in done:
+            if future.exception() is None and future.result() is not None:
+                scores.append(future.result())
+    return scores
+
+
+def enrich_congestion(shipment, n_samples=3):
+    if shipment.get("route_polyline"):
+        # Evenly spaced along the whole route
+        subsampled = polyline.sample(shipment["route_polyline"], n_samples)
+    else:
+        points = shipment.get("route_points", [])
+        if not points:
+            return shipment
+        step = max(1, len(points) // n_samples)
+        subsampled = points[::step][:n_samples]
+
+    # Partial results: average whatever arrived before the deadline
+    scores = congestion_scores(subsampled)
     if scores:
         shipment["congestion_index"] = round(sum(scores) / len(scores), 2)
     else:
         shipment["congestion_index"] = 0.3
     return shipment
 
+def enrich_congestion_batch(shipments: list[dict]) -> list[dict]:
+    return map_batch(enrich_congestion, shipments)
+
 # ---------------------------
 # API Endpoints
 # ---------------------------
 @app.get("/health")
 def health():
-    return {"status": "alive"}
+    return {
+        "status": "alive",
+        "flow_cache": flow_cache.stats(),
+        "late_lookups": late_lookups,
+        "single_flight": traffic_flight.stats(),
+    }
     
 @app.post("/enrich_congestion")
 async def enrich_endpoint(request: Request):
-    shipment = await request.json()
-    return enrich_congestion(shipment)
+    shipment = await jsonio.read_json(request)
+    return jsonio.response(await run_in_threadpool(enrich_congestion, shipment))
+
+@app.post("/enrich_congestion_batch")
+async def enrich_batch_endpoint(request: Request):
+    shipments = await jsonio.read_json(request)
+    before = jsonio.snapshot(request, shipments)
+    results = await run_in_threadpool(enrich_congestion_batch, shipments)
+    return jsonio.response(jsonio.delta(before, results))
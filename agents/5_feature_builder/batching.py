@@ -0,0 +1,79 @@
+"""Helpers behind the agents' *_batch endpoints.
+
+Copied into every agent by scripts/sync_shared.py; edit shared/batching.py.
+
+A batch endpoint returns one result per input, in order. A shipment that
+fails comes back as {"shipment_id": ..., "stage_error": "..."} so one bad
+record never fails the whole batch.
+"""
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "8"))
+
+
+def shipment_id(item):
+    if isinstance(item, dict):
+        return item.get("shipment_id")
+    return getattr(item, "shipment_id", None)
+
+
+def stage_error(item, error: Exception) -> dict:
+    # HTTPException carries its message in .detail
+    detail = getattr(error, "detail", None) or f"{type(error).__name__}: {error}"
+    return {"shipment_id": shipment_id(item), "stage_error": str(detail)}
+
+
+def as_model(model, item):
+    """`item` validated as the pydantic `model`.
+
+    Call it inside the per-item function so an invalid record fails on its own
+    instead of the whole batch failing validation.
+    """
+    return item if isinstance(item, model) else model(**item)
+
+
+def require_list(body) -> list:
+    # Batch endpoints take a JSON array
+    if not isinstance(body, list):
+        raise HTTPException(status_code=422, detail="Expected a list of shipments")
+    return body
+
+
+def _guarded(fn):
+    def run(item):
+        try:
+            return fn(item)
+        except Exception as e:
+            return stage_error(item, e)
+    return run
+
+
+def map_batch(fn, items: list, max_workers: int | None = None) -> list:
+    """Apply a blocking `fn` to every item, in a thread pool when max_workers > 1."""
+    workers = min(max_workers or BATCH_WORKERS, len(items))
+    if workers <= 1:
+        return [_guarded(fn)(item) for item in items]
+    # Worker threads start with an empty context; carry the caller's (trace) context over
+    context = contextvars.copy_context()
+    run = _guarded(fn)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda item: context.copy().run(run, item), items))
+
+
+async def amap_batch(fn, items: list, limit: int | None = None) -> list:
+    """Await an async `fn` for every item, at most `limit` at a time."""
+    semaphore = asyncio.Semaphore(limit or BATCH_WORKERS)
+
+    async def run(item):
+        async with semaphore:
+            try:
+                return await fn(item)
+            except Exception as e:
+                return stage_error(item, e)
+
+    return await asyncio.gather(*(run(item) for item in items))
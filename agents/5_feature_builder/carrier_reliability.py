@@ -0,0 +1,145 @@
+import json
+import math
+import os
+import threading
+import time
+
+# Starting point for every carrier before any outcome has been observed
+BASE_RELIABILITY = {
+    "DHL": 0.82,
+    "UPS": 0.78,
+    "FedEx": 0.75,
+    "Posta": 0.65,
+}
+DEFAULT_RELIABILITY = 0.70
+
+
+class CarrierReliability:
+    """On-time rate per carrier, learned from observed delivery outcomes.
+
+    Each carrier starts at its base rate, worth `prior_weight` deliveries.
+    Outcomes decay with a half-life of `half_life` seconds, so the rate follows
+    recent performance and drifts back to the base rate when nothing is
+    reported. Lookups read an immutable table that a background thread
+    rebuilds every `interval` seconds from the outcomes recorded since, so
+    the same carrier gets the same value until the next refresh.
+    """
+
+    def __init__(self, path: str | None = None, half_life: float = 30 * 86400, prior_weight: float = 20.0,
+                 interval: float = 300.0):
+        self.path = path
+        self.half_life = half_life
+        self.prior_weight = prior_weight
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pending = []
+        # carrier -> [decayed deliveries, decayed on-time deliveries, as of time]
+        self._totals = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self.recorded = 0
+        self.refreshes = 0
+        if path and os.path.exists(path):
+            self.load()
+        self.table = self._build(time.time())
+
+    def get(self, carrier: str) -> float:
+        return self.table.get(carrier, self.table.get(None, DEFAULT_RELIABILITY))
+
+    def get_many(self, carriers: list) -> list[float]:
+        table = self.table
+        default = table.get(None, DEFAULT_RELIABILITY)
+        return [table.get(carrier, default) for carrier in carriers]
+
+    def record(self, carrier: str, on_time: bool, ts: float | None = None):
+        with self._lock:
+            now = time.time()
+            self._pending.append((carrier, bool(on_time), now if ts is None else min(ts, now)))
+            self.recorded += 1
+
+    def _decay(self, entry: list, now: float):
+        if now > entry[2]:
+            factor = math.pow(0.5, (now - entry[2]) / self.half_life)
+            entry[0] *= factor
+            entry[1] *= factor
+            entry[2] = now
+
+    def _build(self, now: float) -> dict:
+        with self._lock:
+            for entry in self._totals.values():
+                self._decay(entry, now)
+            totals = {carrier: (n, on_time) for carrier, (n, on_time, _) in self._totals.items()}
+        table = {None: DEFAULT_RELIABILITY, **BASE_RELIABILITY}
+        for carrier, (n, on_time) in totals.items():
+            prior = BASE_RELIABILITY.get(carrier, DEFAULT_RELIABILITY)
+            table[carrier] = round((prior * self.prior_weight + on_time) / (self.prior_weight + n), 2)
+        return table
+
+    def refresh(self):
+        """Fold the outcomes recorded since the last refresh into the table."""
+        now = time.time()
+        with self._lock:
+            pending, self._pending = self._pending, []
+            # Oldest first, so each outcome is decayed from when it happened
+            for carrier, on_time, ts in sorted(pending, key=lambda outcome: outcome[2]):
+                entry = self._totals.setdefault(carrier, [0.0, 0.0, ts])
+                self._decay(entry, ts)
+                weight = math.pow(0.5, (entry[2] - ts) / self.half_life) if ts < entry[2] else 1.0
+                entry[0] += weight
+                entry[1] += weight * on_time
+        self.table = self._build(now)
+        self.refreshes += 1
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            totals = {carrier: entry for carrier, entry in self._totals.items()}
+            data = json.dumps(totals)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                totals = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not load carrier reliability from {self.path}: {e}")
+            return
+        with self._lock:
+            self._totals = {carrier: [float(n), float(on_time), float(ts)] for carrier, (n, on_time, ts) in totals.items()}
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Carrier reliability refresh failed: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="carrier-reliability", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.refresh()
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+            observed = {carrier: round(entry[0], 1) for carrier, entry in self._totals.items()}
+        return {
+            "recorded": self.recorded,
+            "pending": pending,
+            "refreshes": self.refreshes,
+            "observed": observed,
+            "table": {carrier: value for carrier, value in self.table.items() if carrier is not None},
+        }
@@ -1,53 +1,140 @@
-import random
-from datetime import datetime
+import os
+import warnings
+from datetime import datetime, timezone
+
+import numpy as np
 from fastapi import FastAPI, Request
 
+from batching import stage_error
+from carrier_reliability import CarrierReliability
+import jsonio
+import metrics
+import tracing
+
 app = FastAPI(title="Feature Builder Agent")
+metrics.instrument(app)
+tracing.instrument(app, "features")
 
-def hours_between(a_iso, b_iso):
+# Carrier reliability learned from delivery outcomes posted to /carrier_outcomes.
+# CARRIER_RELIABILITY_PATH persists it; the table is rebuilt every CARRIER_REFRESH_INTERVAL seconds.
+carriers = CarrierReliability(
+    path=os.getenv("CARRIER_RELIABILITY_PATH") or None,
+    half_life=float(os.getenv("CARRIER_HALF_LIFE_DAYS", "30")) * 86400,
+    prior_weight=float(os.getenv("CARRIER_PRIOR_WEIGHT", "20")),
+    interval=float(os.getenv("CARRIER_REFRESH_INTERVAL", "300")),
+)
+metrics.track_stats("carrier_reliability", carriers.stats)
+DEFAULT_HOURS_TO_DEADLINE = 24.0
+
+def parse_timestamp(value) -> np.datetime64:
+    """ISO-8601 timestamp as UTC datetime64 (naive ones count as UTC); NaT if unusable."""
     try:
-        a = datetime.fromisoformat(a_iso.replace("Z", "+00:00"))
-        b = datetime.fromisoformat(b_iso.replace("Z", "+00:00"))
-        return abs((b - a).total_seconds()) / 3600.0
-    except Exception:
-        return 24.0
+        ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, TypeError, ValueError):
+        return np.datetime64("NaT")
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(ts, "s")
+
+def parse_timestamps(values: list) -> np.ndarray:
+    """Parse a column of timestamps in one go, falling back to one by one for unusual formats."""
+    cleaned = [(v[:-1] if v.endswith("Z") else v) if isinstance(v, str) else None for v in values]
+    try:
+        with warnings.catch_warnings():
+            # NumPy only warns about UTC offsets; parse those one by one instead
+            warnings.simplefilter("error")
+            return np.array(cleaned, dtype="datetime64[s]")
+    except (ValueError, TypeError, Warning):
+        return np.array([parse_timestamp(v) for v in values], dtype="datetime64[s]")
+
+def hours_to_deadline(dispatch: list, expected: list) -> np.ndarray:
+    delta = np.abs(parse_timestamps(expected) - parse_timestamps(dispatch))
+    hours = delta.astype("float64") / 3600.0
+    return np.round(np.where(np.isnat(delta), DEFAULT_HOURS_TO_DEADLINE, hours), 2)
+
+def hours_between(a_iso, b_iso):
+    return float(hours_to_deadline([a_iso], [b_iso])[0])
 
-# __define-ocg__: carrier reliability lookup with default + variation
 def get_carrier_reliability(carrier: str) -> float:
-    base_reliability = {
-        "DHL": 0.82,
-        "UPS": 0.78,
-        "FedEx": 0.75,
-        "Posta": 0.65,
-    }
-    default_reliability = 0.70
-    reliability = base_reliability.get(carrier, default_reliability)
-    
-    # Add slight random variation to simulate live fluctuations
-    variation = random.uniform(-0.03, 0.03)
-    varOcg = max(0.0, min(1.0, reliability + variation))  # clamp [0,1]
-    
-    return round(varOcg, 2)
-
-def build_features(s: dict) -> dict:
-    hours_to_deadline = hours_between(s.get("dispatch_ts", ""), s.get("expected_ts", ""))
+    return carriers.get(carrier)
+
+def build_features(s: dict, hours: float | None = None, reliability: float | None = None) -> dict:
+    if hours is None:
+        hours = hours_between(s.get("dispatch_ts", ""), s.get("expected_ts", ""))
+    if reliability is None:
+        reliability = get_carrier_reliability(s.get("carrier", ""))
     features = {
         "shipment_id": s["shipment_id"],
         "distance_km": float(s.get("distance_km", 0)),
-        "hours_to_deadline": float(round(hours_to_deadline, 2)),
+        "hours_to_deadline": float(hours),
         "origin_rain_mm": float(s.get("origin_rain_mm", 0.0)),
         "origin_storm": int(s.get("origin_storm", 0)),
         "congestion_index": float(s.get("congestion_index", 0.2)),
-        "carrier_reliability": get_carrier_reliability(s.get("carrier", ""))
+        "carrier_reliability": reliability,
     }
     s["features"] = features
     return s
 
+def build_features_batch(shipments: list[dict]) -> list[dict]:
+    # Timestamps are parsed and carriers looked up for the whole batch at once
+    hours = hours_to_deadline(
+        [s.get("dispatch_ts", "") for s in shipments],
+        [s.get("expected_ts", "") for s in shipments],
+    )
+    reliability = carriers.get_many([s.get("carrier", "") for s in shipments])
+    results = []
+    for s, h, r in zip(shipments, hours.tolist(), reliability):
+        try:
+            results.append(build_features(s, h, r))
+        except Exception as e:
+            results.append(stage_error(s, e))
+    return results
+
+def record_outcome(outcome: dict):
+    """{"carrier", "on_time"} or {"carrier", "expected_ts", "delivered_ts"}."""
+    if "on_time" in outcome:
+        on_time = bool(outcome["on_time"])
+    else:
+        expected, delivered = parse_timestamp(outcome.get("expected_ts")), parse_timestamp(outcome.get("delivered_ts"))
+        if np.isnat(expected) or np.isnat(delivered):
+            raise ValueError("needs on_time, or expected_ts and delivered_ts")
+        on_time = bool(delivered <= expected)
+    delivered = parse_timestamp(outcome.get("delivered_ts"))
+    ts = None if np.isnat(delivered) else float(delivered.astype("int64"))
+    carriers.record(outcome["carrier"], on_time, ts)
+
+@app.on_event("startup")
+def start_carrier_refresh():
+    carriers.start()
+
+@app.on_event("shutdown")
+def stop_carrier_refresh():
+    carriers.stop()
+
 @app.get("/health")
 def health():
-    return {"status": "alive"}
+    return {"status": "alive", "carrier_reliability": carriers.stats()}
 
 @app.post("/build_features")
 async def build_features_endpoint(request: Request):
-    shipment = await request.json()
-    return build_features(shipment)
+    shipment = await jsonio.read_json(request)
+    return jsonio.response(build_features(shipment))
+
+@app.post("/build_features_batch")
+async def build_features_batch_endpoint(request: Request):
+    shipments = await jsonio.read_json(request)
+    before = jsonio.snapshot(request, shipments)
+    return jsonio.response(jsonio.delta(before, build_features_batch(shipments)))
+
+@app.post("/carrier_outcomes")
+async def carrier_outcomes_endpoint(request: Request):
+    """Observed deliveries (one or a list); they count from the next table refresh."""
+    body = await jsonio.read_json(request)
+    outcomes = [body] if isinstance(body, dict) else body
+    errors = []
+    for i, outcome in enumerate(outcomes):
+        try:
+            record_outcome(outcome)
+        except (KeyError, TypeError, ValueError) as e:
+            errors.append({"index": i, "detail": f"{type(e).__name__}: {e}"})
+    return {"recorded": len(outcomes) - len(errors), "errors": errors}
@@ -0,0 +1,211 @@
+"""Lightweight distributed tracing with W3C `traceparent` propagation.
+
+Copied by scripts/sync_shared.py into the orchestrator and every agent; edit
+shared/tracing.py.
+
+`instrument(app, service)` starts a server span for every request, continuing
+the caller's trace when a `traceparent` header comes in. http_client wraps
+each outbound call in a client span and sends the header on, so one request
+to the orchestrator becomes a single trace across all agents and their
+TomTom / Open-Meteo / Hugging Face / Gemini calls.
+
+Finished spans are written as JSON lines to TRACE_FILE and/or posted in
+batches to TRACE_COLLECTOR_URL. With neither set, ids are still propagated
+but nothing is exported.
+"""
+import atexit
+import contextvars
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_COLLECTOR_URL = os.getenv("TRACE_COLLECTOR_URL", "")
+SERVICE = os.getenv("TRACE_SERVICE", "")
+
+# (trace_id, span_id) of the span running in this context
+_current = contextvars.ContextVar("trace_context", default=None)
+# Service the running code belongs to; several apps can share this module in one process
+_service = contextvars.ContextVar("trace_service", default=None)
+
+
+class Span:
+    def __init__(self, name: str, kind: str, parent: tuple | None, attributes: dict):
+        self.trace_id = parent[0] if parent else secrets.token_hex(16)
+        self.parent_id = parent[1] if parent else None
+        self.span_id = secrets.token_hex(8)
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.start = time.time()
+        self.service = _service.get() or SERVICE
+        self.status = "ok"
+        self.error = None
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def fail(self, error):
+        self.status = "error"
+        self.error = error if isinstance(error, str) else f"{type(error).__name__}: {error}"
+
+    def to_dict(self, duration: float) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "service": self.service,
+            "start": self.start,
+            "duration_ms": round(duration * 1000, 3),
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+def parse_traceparent(value: str | None) -> tuple | None:
+    parts = (value or "").strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2]
+
+
+def traceparent() -> str | None:
+    context = _current.get()
+    return f"00-{context[0]}-{context[1]}-01" if context else None
+
+
+def headers() -> dict:
+    """Headers that continue the current trace in the next service."""
+    value = traceparent()
+    return {"traceparent": value} if value else {}
+
+
+def current() -> tuple | None:
+    """(trace_id, span_id) of the running span, to parent work that starts later."""
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", parent: tuple | None = None, **attributes):
+    """Run the block as a child of the current span (or of `parent`, or as a new trace)."""
+    current = Span(name, kind, parent or _current.get(), attributes)
+    token = _current.set((current.trace_id, current.span_id))
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.fail(e)
+        raise
+    finally:
+        _current.reset(token)
+        _export(current.to_dict(time.perf_counter() - start))
+
+
+@contextmanager
+def as_service(name: str | None):
+    """Record spans started in the block as `name`, e.g. an agent run in-process."""
+    token = _service.set(name)
+    try:
+        yield
+    finally:
+        _service.reset(token)
+
+
+# -------- Export --------
+_queue = queue.Queue(maxsize=10_000)
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def _export(record: dict):
+    if not (TRACE_FILE or TRACE_COLLECTOR_URL):
+        return
+    global _thread
+    if _thread is None:
+        with _thread_lock:
+            if _thread is None:
+                _thread = threading.Thread(target=_run_exporter, name="trace-export", daemon=True)
+                _thread.start()
+    try:
+        _queue.put_nowait(record)
+    except queue.Full:
+        pass  # never slow the request down for tracing
+
+
+def _write(batch: list[dict]):
+    if TRACE_FILE:
+        with open(TRACE_FILE, "a") as f:
+            f.writelines(json.dumps(record, default=str) + "\n" for record in batch)
+    if TRACE_COLLECTOR_URL:
+        body = json.dumps(batch, default=str).encode()
+        req = urllib.request.Request(TRACE_COLLECTOR_URL, data=body, headers={"Content-Type": "application/json"})
+        urllib.request.urlopen(req, timeout=5).close()
+
+
+def _drain(wait: float) -> list[dict]:
+    batch = []
+    try:
+        batch.append(_queue.get(timeout=wait))
+        while len(batch) < 500:
+            batch.append(_queue.get_nowait())
+    except queue.Empty:
+        pass
+    return batch
+
+
+def _run_exporter():
+    while True:
+        batch = _drain(1.0)
+        if batch:
+            try:
+                _write(batch)
+            except Exception as e:
+                print(f"Span export failed: {e}")
+
+
+@atexit.register
+def flush():
+    batch = _drain(0)
+    while batch:
+        try:
+            _write(batch)
+        except Exception as e:
+            print(f"Span export failed: {e}")
+            return
+        batch = _drain(0)
+
+
+# -------- FastAPI --------
+def instrument(app, service: str):
+    """Trace every request of a FastAPI app as `service`, continuing incoming traces.
+
+    The name is kept on app.state.trace_service for callers that run the
+    app's code without going through HTTP (see as_service()).
+    """
+    global SERVICE
+    name = os.getenv("TRACE_SERVICE") or service
+    app.state.trace_service = name
+    # Spans outside any request (startup, background threads) use the first app's name
+    SERVICE = SERVICE or name
+
+    @app.middleware("http")
+    async def trace_request(request, call_next):
+        parent = parse_traceparent(request.headers.get("traceparent"))
+        with as_service(name), span(f"{request.method} {request.url.path}", kind="server", parent=parent) as current:
+            response = await call_next(request)
+            route = request.scope.get("route")
+            if route is not None:
+                current.name = f"{request.method} {route.path}"
+            current.set("status", response.status_code)
+            if response.status_code >= 500:
+                current.fail(f"HTTP {response.status_code}")
+            response.headers["traceparent"] = f"00-{current.trace_id}-{current.span_id}-01"
+            return response
@@ -1,58 +1,106 @@
 from fastapi import FastAPI, Request
-import pickle
 import numpy as np
 import os
 
+from batching import map_batch
+import jsonio
+import metrics
+from forest import load_forest
+from prediction_cache import PredictionCache, parse_decimals
+import tracing
+
 app = FastAPI(title="Shipment Risk Scoring Agent")
+metrics.instrument(app)
+tracing.instrument(app, "risk")
 
-# Try loading ML model
-MODEL_PATH = "shipment_delay_model.pkl"
+# Try loading ML model (compiled from model/shipment_delay_model.pkl, see forest.py)
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "shipment_delay_model.forest")
 model = None
 if os.path.exists(MODEL_PATH):
-    with open(MODEL_PATH, "rb") as f:
-        model = pickle.load(f)
+    model = load_forest(MODEL_PATH)
+
+# Scores reused for shipments whose features round to the same values
+# (RISK_CACHE_DECIMALS overrides the rounding per feature, RISK_CACHE_SIZE=0 disables it)
+risk_cache = PredictionCache(
+    decimals=parse_decimals(os.getenv("RISK_CACHE_DECIMALS", "")),
+    maxsize=int(os.getenv("RISK_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("RISK_CACHE_TTL", "600")),
+)
+metrics.track_stats("risk_scores", risk_cache.stats)
+
+# -------- Vectorized batch scoring --------
+# Model input columns, in training order, with their defaults
+ML_FEATURES = [
+    ("distance_km", 0.0),
+    ("hours_to_deadline", 0.0),
+    ("origin_rain_mm", 0.0),
+    ("origin_storm", 0),
+    ("congestion_index", 0.0),
+    ("carrier_reliability", 0.7),
+]
+
+def _column(features: list[dict], name: str, default) -> np.ndarray:
+    column = np.array([f.get(name, default) for f in features], dtype=float)
+    if np.isnan(column).any():
+        # None / "nan" would otherwise score as NaN instead of raising
+        raise ValueError(f"{name} is not a number")
+    return column
+
+def baseline_scores(features: list[dict]) -> np.ndarray:
+    """Rule-based delay probability for N feature dicts at once."""
+    p = np.full(len(features), 0.15)
+    p += np.minimum(_column(features, "distance_km", 0) / 1000.0, 0.15)
+    p += np.where(_column(features, "origin_storm", 0) != 0, 0.25, 0.0)
+    p += np.minimum(_column(features, "origin_rain_mm", 0.0) / 50.0, 0.15)
+    p += np.minimum(_column(features, "congestion_index", 0.2) * 0.3, 0.30)
+    p -= np.maximum(0.0, _column(features, "carrier_reliability", 0.7) - 0.7)
+    return np.clip(p, 0.0, 0.99)
 
-# -------- Baseline rule-based model --------
 def baseline_score(features: dict) -> float:
-    p = 0.15
-    p += min(features.get("distance_km", 0) / 1000.0, 0.15)
-    p += 0.25 if features.get("origin_storm", 0) else 0.0
-    p += min(features.get("origin_rain_mm", 0.0) / 50.0, 0.15)
-    p += min(features.get("congestion_index", 0.2) * 0.3, 0.30)
-    p -= max(0.0, (features.get("carrier_reliability", 0.7) - 0.7))  # better carrier reduces risk
-    return max(0.0, min(p, 0.99))
-
-# -------- ML model predictor --------
-def ml_score(features: dict) -> float | None:
+    return float(baseline_scores([features])[0])
+
+def ml_scores(features: list[dict]) -> np.ndarray | None:
+    """ML delay probability for N feature dicts with a single predict_proba call."""
     if model is None:
-        return None  # fallback if model isn't loaded
-
-    numeric_features = {
-        "distance_km": features.get("distance_km", 0.0),
-        "hours_to_deadline": features.get("hours_to_deadline", 0.0),
-        "origin_rain_mm": features.get("origin_rain_mm", 0.0),
-        "origin_storm": features.get("origin_storm", 0),
-        "congestion_index": features.get("congestion_index", 0.0),
-        "carrier_reliability": features.get("carrier_reliability", 0.7),
-    }
-
-    arr = np.array([[numeric_features["distance_km"],
-                 numeric_features["hours_to_deadline"],
-                 numeric_features["origin_rain_mm"],
-                 numeric_features["origin_storm"],
-                 numeric_features["congestion_index"],
-                 numeric_features["carrier_reliability"]]])
-    prob = model.predict_proba(arr)[0][1]
-    return float(prob)
+        return None
+    X = np.column_stack([_column(features, name, default) for name, default in ML_FEATURES])
+    return model.predict_proba(X)[:, 1]
+
+def ml_score(features: dict) -> float | None:
+    probs = ml_scores([features])
+    return float(probs[0]) if probs is not None else None
 
 # -------- Unified risk function --------
-def add_risk(shipment: dict) -> dict:
-    f = shipment.get("features", {})
+def score_features(features: list[dict]) -> list[tuple[float, float | None]]:
+    """(baseline, ML) probabilities per feature dict, scoring each uncached feature vector once."""
+    scores = [None] * len(features)
+    pending = {}  # cache key (or row index when not cacheable) -> rows sharing it
+    for i, f in enumerate(features):
+        key = risk_cache.key(f)
+        hit = risk_cache.get(key) if key not in pending else None
+        if hit is not None:
+            scores[i] = hit
+        else:
+            pending.setdefault(key if key is not None else i, []).append(i)
 
-    # Compute both
-    base_prob = baseline_score(f)
-    ml_prob = ml_score(f) if model else None
+    if pending:
+        rows = [features[idx[0]] for idx in pending.values()]
+        base = baseline_scores(rows)
+        ml = ml_scores(rows)
+        for j, (key, idx) in enumerate(pending.items()):
+            score = (float(base[j]), float(ml[j]) if ml is not None else None)
+            # Baseline-only scores are not cached so the ML score is picked up once it is back
+            if score[1] is not None and isinstance(key, tuple):
+                risk_cache.set(key, score)
+            for i in idx:
+                scores[i] = score
+    return scores
+
+def add_risk(shipment: dict) -> dict:
+    base_prob, ml_prob = score_features([shipment.get("features", {})])[0]
+    return apply_risk(shipment, base_prob, ml_prob)
 
+def apply_risk(shipment: dict, base_prob: float, ml_prob: float | None) -> dict:
     # Choose the larger one
     if ml_prob is not None:
         delay_prob = max(base_prob, ml_prob)
@@ -71,11 +119,29 @@ def add_risk(shipment: dict) -> dict:
     shipment["source"] = source
     return shipment
 
+def add_risk_batch(shipments: list[dict]) -> list[dict]:
+    if not shipments:
+        return []
+    features = [s.get("features", {}) for s in shipments]
+    try:
+        scores = score_features(features)
+    except (TypeError, ValueError):
+        # A malformed feature dict breaks the matrix; score one by one to isolate it
+        return map_batch(add_risk, shipments, max_workers=1)
+
+    return [apply_risk(s, *scores[i]) for i, s in enumerate(shipments)]
+
 @app.get("/health")
 def health():
-    return {"status": "alive"}
+    return {"status": "alive", "model_loaded": model is not None, "risk_cache": risk_cache.stats()}
 
 @app.post("/score")
 async def score_endpoint(request: Request):
-    shipment = await request.json()
-    return add_risk(shipment)
+    shipment = await jsonio.read_json(request)
+    return jsonio.response(add_risk(shipment))
+
+@app.post("/score_batch")
+async def score_batch_endpoint(request: Request):
+    shipments = await jsonio.read_json(request)
+    before = jsonio.snapshot(request, shipments)
+    return jsonio.response(jsonio.delta(before, add_risk_batch(shipments)))
@@ -0,0 +1,243 @@
+"""In-process metrics in the Prometheus text format, without extra dependencies.
+
+Copied by scripts/sync_shared.py into the orchestrator and every agent; edit
+shared/metrics.py.
+
+    metrics.instrument(app)        # request latency / in-flight / errors + GET /metrics
+    metrics.track_stats("route_cache", route_cache.stats)
+    with metrics.UPSTREAM_LATENCY.time(upstream="gemini"):
+        ...
+
+http_client records the latency, status and in-flight count of every
+outbound call per upstream host, so each service's /metrics shows whether
+TomTom, Open-Meteo, Gemini or the next agent is the slow part.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_metrics = {}
+_stats = {}
+
+
+def _labels(names: tuple, values: dict) -> tuple:
+    return tuple(str(values.get(name, "")) for name in names)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> list[str]:
+        with _lock:
+            values = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.label_names, key)} {_number(value)}" for key, value in values
+        ]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(self.label_names, labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with _lock:
+            self._values[_labels(self.label_names, labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(self.label_names, labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the block as in flight while it runs."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = _labels(self.label_names, labels)
+        with _lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list[str]:
+        with _lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = self._header()
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                labels = _format_labels(self.label_names, key, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def _register(cls, name: str, *args):
+    """The metric registered under `name`, created on first use.
+
+    Modules imported more than once in one process (each local agent brings its
+    own http_client, single_flight, ...) then share one metric family.
+    """
+    with _lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = cls(name, *args)
+        elif type(metric) is not cls:
+            raise ValueError(f"metric {name} is already registered as a {metric.kind}")
+        return metric
+
+
+def counter(name: str, help: str, labels: tuple = ()) -> Counter:
+    return _register(Counter, name, help, labels)
+
+
+def gauge(name: str, help: str, labels: tuple = ()) -> Gauge:
+    return _register(Gauge, name, help, labels)
+
+
+def histogram(name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram, name, help, labels, buckets)
+
+
+def track_stats(name: str, stats):
+    """Export the numeric fields of `stats()` (a cache's hits, misses, hit_ratio, ...) as cache_<field>{cache=name}."""
+    with _lock:
+        _stats[name] = stats
+
+
+def _render_stats() -> list[str]:
+    with _lock:
+        sources = list(_stats.items())
+    fields = {}
+    for name, stats in sources:
+        try:
+            values = stats()
+        except Exception as e:
+            print(f"Could not read stats for {name}: {e}")
+            continue
+        for field, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                fields.setdefault(field, []).append((name, value))
+    lines = []
+    for field, values in sorted(fields.items()):
+        metric = f"cache_{field}"
+        lines += [f"# HELP {metric} {field} reported by the cache's stats()", f"# TYPE {metric} gauge"]
+        lines += [f'{metric}{{cache="{_escape(name)}"}} {_number(value)}' for name, value in values]
+    return lines
+
+
+def render() -> str:
+    with _lock:
+        metrics = list(_metrics.values())
+    lines = []
+    for metric in metrics:
+        lines += metric.render()
+    return "\n".join(lines + _render_stats()) + "\n"
+
+
+# -------- Metrics every service shares --------
+REQUEST_LATENCY = histogram(
+    "http_request_duration_seconds", "Time spent serving requests to this service", ("method", "path", "status")
+)
+REQUESTS_IN_FLIGHT = gauge("http_requests_in_flight", "Requests this service is serving right now")
+UPSTREAM_LATENCY = histogram(
+    "upstream_request_duration_seconds", "Latency of outbound calls per attempt", ("upstream", "status")
+)
+UPSTREAM_ERRORS = counter(
+    "upstream_errors_total", "Outbound calls that failed or returned an error status", ("upstream", "reason")
+)
+UPSTREAM_IN_FLIGHT = gauge("upstream_requests_in_flight", "Outbound calls waiting for an answer", ("upstream",))
+
+
+def instrument(app):
+    """Time every request of a FastAPI app and serve GET /metrics."""
+    from starlette.responses import PlainTextResponse
+
+    @app.middleware("http")
+    async def record_request(request, call_next):
+        start = time.perf_counter()
+        status = "500"
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            response = await call_next(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            # The route template keeps ids out of the labels (/jobs/{job_id}); unmatched
+            # paths (404s, scanners) share one label instead of one series each
+            route = request.scope.get("route")
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - start,
+                method=request.method,
+                path=getattr(route, "path", "unmatched"),
+                status=status,
+            )
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics_endpoint():
+        return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
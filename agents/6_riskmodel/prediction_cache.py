@@ -0,0 +1,91 @@
+"""Memoizes risk scores on a quantized feature vector.
+
+Copied by scripts/sync_shared.py into both risk agents; edit
+shared/prediction_cache.py.
+
+Shipments on the same lane, carrier and day produce near-identical features.
+Each feature is rounded to its configured number of decimals and the rounded
+tuple is the cache key, so those shipments reuse one score instead of running
+the models again. Entries live in a bounded LRU and expire after `ttl` seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# Rounding per model feature: distance to 1 km, deadline to the hour, rain to 0.1 mm
+DEFAULT_DECIMALS = {
+    "distance_km": 0,
+    "hours_to_deadline": 0,
+    "origin_rain_mm": 1,
+    "origin_storm": 0,
+    "congestion_index": 2,
+    "carrier_reliability": 2,
+}
+
+
+def parse_decimals(spec: str) -> dict:
+    """Overrides like "distance_km=-1,congestion_index=1" on top of DEFAULT_DECIMALS."""
+    decimals = dict(DEFAULT_DECIMALS)
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        decimals[name.strip()] = int(value)
+    return decimals
+
+
+class PredictionCache:
+    def __init__(self, decimals: dict | None = None, maxsize: int = 10_000, ttl: float = 600.0):
+        self.decimals = decimals or dict(DEFAULT_DECIMALS)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    def key(self, features: dict) -> tuple | None:
+        """Quantized feature tuple, or None when a value is not numeric (not cacheable)."""
+        if not self.enabled:
+            return None
+        try:
+            return tuple(
+                round(float(features[name]), digits) if name in features else None
+                for name, digits in self.decimals.items()
+            )
+        except (TypeError, ValueError):
+            return None
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] > time.time():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            self._data.pop(key, None)
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        if key is None:
+            return
+        with self._lock:
+            self._data[key] = (value, time.time() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "size": len(self._data),
+        }
@@ -0,0 +1,53 @@
+import threading
+import time
+
+
+class CircuitBreaker:
+    """Stops calling an upstream that keeps failing or answering too slowly.
+
+    closed:    calls go through; `failure_threshold` consecutive failures open it.
+    open:      calls are refused until `reset_timeout` seconds have passed.
+    half_open: one probe call is let through; success closes the breaker,
+               failure opens it again.
+
+    A call that succeeds but takes longer than `latency_budget` seconds counts
+    as a failure.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0, latency_budget: float = 2.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.latency_budget = latency_budget
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, ok: bool, elapsed: float = 0.0):
+        with self._lock:
+            self._probing = False
+            if ok and elapsed <= self.latency_budget:
+                self.state = "closed"
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "rejected": self.rejected}
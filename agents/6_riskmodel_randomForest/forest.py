@@ -0,0 +1,135 @@
+"""Pickle-free random forest artifact and a NumPy-only inference engine.
+
+Copied by scripts/sync_shared.py into model/ and the risk services; edit
+shared/forest.py.
+
+A trained scikit-learn RandomForestClassifier (binary) is flattened into one
+node table shared by all trees and written column by column to a `.forest`
+file (little-endian):
+
+    magic      8 bytes   b"CSFOREST"
+    header     24 bytes  uint32 version, n_features, n_trees, max_depth; uint64 n_nodes
+    roots      int64[n_trees]     index of each tree's root node
+    left       int32[n_nodes]     left child
+    right      int32[n_nodes]     right child
+    feature    int32[n_nodes]     feature tested
+    threshold  float64[n_nodes]   go left when x[feature] <= threshold
+    value      float64[n_nodes]   leaf probability of the positive class
+
+Child indexes point into the shared table. Leaves point to themselves, so
+walking max_depth steps from the roots always ends on a leaf. Loading memory-maps the file,
+so scoring needs only NumPy, starts in milliseconds and worker processes
+share the page cache instead of each holding a copy of the forest.
+
+Convert an existing pickle (with the scikit-learn version it was saved with):
+
+    python forest.py shipment_delay_model.pkl shipment_delay_model.forest
+"""
+import struct
+import sys
+
+import numpy as np
+
+MAGIC = b"CSFOREST"
+VERSION = 1
+HEADER = struct.Struct("<IIIIQ")
+COLUMNS = [("left", "<i4"), ("right", "<i4"), ("feature", "<i4"), ("threshold", "<f8"), ("value", "<f8")]
+
+
+def export_forest(clf, path: str):
+    """Write a fitted binary RandomForestClassifier to `path`."""
+    if len(clf.classes_) != 2:
+        raise ValueError("only binary classifiers can be exported")
+
+    columns = {name: [] for name, _ in COLUMNS}
+    roots, offset, max_depth = [], 0, 0
+    for estimator in clf.estimators_:
+        tree = estimator.tree_
+        index = np.arange(tree.node_count) + offset
+        left = tree.children_left.astype(np.int64)
+        right = tree.children_right.astype(np.int64)
+        leaf = left == -1
+        counts = tree.value[:, 0, :]
+
+        columns["left"].append(np.where(leaf, index, left + offset))
+        columns["right"].append(np.where(leaf, index, right + offset))
+        columns["feature"].append(np.where(leaf, 0, tree.feature))
+        columns["threshold"].append(np.where(leaf, 0.0, tree.threshold))
+        columns["value"].append(np.where(leaf, counts[:, 1] / counts.sum(axis=1), 0.0))
+
+        roots.append(offset)
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(HEADER.pack(VERSION, clf.n_features_in_, len(roots), max_depth, offset))
+        f.write(np.asarray(roots, dtype="<i8").tobytes())
+        for name, dtype in COLUMNS:
+            f.write(np.concatenate(columns[name]).astype(dtype).tobytes())
+
+
+class CompiledForest:
+    """Memory-mapped forest exposing predict_proba like the original classifier."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a compiled forest")
+            version, self.n_features_in_, n_trees, self.max_depth, n_nodes = HEADER.unpack(
+                f.read(HEADER.size)
+            )
+        if version != VERSION:
+            raise ValueError(f"unsupported forest version {version}")
+
+        offset = len(MAGIC) + HEADER.size
+        self.roots = np.memmap(path, dtype="<i8", mode="r", offset=offset, shape=(n_trees,))
+        offset += self.roots.nbytes
+        for name, dtype in COLUMNS:
+            column = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(n_nodes,))
+            setattr(self, name, column)
+            offset += column.nbytes
+        self.classes_ = np.array([0, 1])
+        self.n_estimators = n_trees
+
+    def predict_proba(self, X) -> np.ndarray:
+        # scikit-learn compares float32 inputs against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"expected shape (n, {self.n_features_in_}), got {X.shape}")
+
+        # Walk every (row, tree) pair down one level per step, only keeping
+        # pairs that have not reached their leaf yet
+        n_rows, n_trees = X.shape[0], len(self.roots)
+        x = X.astype(np.float64).ravel()
+        x_offset = np.repeat(np.arange(n_rows, dtype=np.int64) * X.shape[1], n_trees)
+        node = np.tile(np.asarray(self.roots), n_rows)
+        active = np.arange(node.size)
+        for _ in range(self.max_depth):
+            current = node[active]
+            go_left = x[x_offset[active] + self.feature[current]] <= self.threshold[current]
+            step = np.where(go_left, self.left[current], self.right[current])
+            node[active] = step
+            active = active[step != current]
+            if not active.size:
+                break
+
+        p = self.value[node].reshape(n_rows, n_trees).mean(axis=1)
+        return np.column_stack([1.0 - p, p])
+
+    def predict(self, X) -> np.ndarray:
+        return (self.predict_proba(X)[:, 1] > 0.5).astype(int)
+
+
+def load_forest(path: str) -> CompiledForest:
+    return CompiledForest(path)
+
+
+if __name__ == "__main__":
+    import pickle
+
+    if len(sys.argv) != 3:
+        sys.exit("usage: python forest.py MODEL.pkl MODEL.forest")
+    with open(sys.argv[1], "rb") as f:
+        export_forest(pickle.load(f), sys.argv[2])
+    print(f"Wrote {sys.argv[2]}")
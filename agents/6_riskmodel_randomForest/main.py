@@ -1,54 +1,149 @@
 from fastapi import FastAPI, Request
-import requests
+from starlette.concurrency import run_in_threadpool
+import numpy as np
+import os
+import time
+
+import http_client
+from batching import map_batch
+import jsonio
+import metrics
+from circuit_breaker import CircuitBreaker
+from forest import load_forest
+from prediction_cache import PredictionCache, parse_decimals
+import tracing
 
 app = FastAPI(title="Shipment Risk Scoring Agent")
+metrics.instrument(app)
+tracing.instrument(app, "risk")
+
+# Local model (compiled from shipment_delay_model.pkl, see forest.py)
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "shipment_delay_model.forest")
+model = None
+if os.path.exists(MODEL_PATH):
+    model = load_forest(MODEL_PATH)
+
+# Hugging Face Space, only asked when local scoring is unavailable (RISK_REMOTE_FALLBACK=0 disables it)
+HF_API_URL = os.getenv("HF_API_URL", "https://jayem-11-risk-analysis.hf.space")
+RISK_REMOTE_FALLBACK = os.getenv("RISK_REMOTE_FALLBACK", "1") == "1"
+remote_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("RISK_REMOTE_FAILURES", "3")),
+    reset_timeout=float(os.getenv("RISK_REMOTE_RESET", "30")),
+    latency_budget=float(os.getenv("RISK_REMOTE_BUDGET", "2")),
+)
+
+# Scores reused for shipments whose features round to the same values
+# (RISK_CACHE_DECIMALS overrides the rounding per feature, RISK_CACHE_SIZE=0 disables it)
+risk_cache = PredictionCache(
+    decimals=parse_decimals(os.getenv("RISK_CACHE_DECIMALS", "")),
+    maxsize=int(os.getenv("RISK_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("RISK_CACHE_TTL", "600")),
+)
+metrics.track_stats("risk_scores", risk_cache.stats)
+
+# -------- Vectorized scoring --------
+# Model input columns, in training order, with their defaults
+ML_FEATURES = [
+    ("distance_km", 0.0),
+    ("hours_to_deadline", 0.0),
+    ("origin_rain_mm", 0.0),
+    ("origin_storm", 0),
+    ("congestion_index", 0.0),
+    ("carrier_reliability", 0.7),
+]
+
+def _column(features: list[dict], name: str, default) -> np.ndarray:
+    column = np.array([f.get(name, default) for f in features], dtype=float)
+    if np.isnan(column).any():
+        # None / "nan" would otherwise score as NaN instead of raising
+        raise ValueError(f"{name} is not a number")
+    return column
 
-# Load Hugging Face API details
-HF_API_URL = "https://jayem-11-risk-analysis.hf.space/predict"
+def baseline_scores(features: list[dict]) -> np.ndarray:
+    """Rule-based delay probability for N feature dicts at once."""
+    p = np.full(len(features), 0.15)
+    p += np.minimum(_column(features, "distance_km", 0) / 1000.0, 0.15)
+    p += np.where(_column(features, "origin_storm", 0) != 0, 0.25, 0.0)
+    p += np.minimum(_column(features, "origin_rain_mm", 0.0) / 50.0, 0.15)
+    p += np.minimum(_column(features, "congestion_index", 0.2) * 0.3, 0.30)
+    p -= np.maximum(0.0, _column(features, "carrier_reliability", 0.7) - 0.7)
+    return np.clip(p, 0.0, 0.99)
 
-# -------- Baseline rule-based model --------
 def baseline_score(features: dict) -> float:
-    p = 0.15
-    p += min(features.get("distance_km", 0) / 1000.0, 0.15)
-    p += 0.25 if features.get("origin_storm", 0) else 0.0
-    p += min(features.get("origin_rain_mm", 0.0) / 50.0, 0.15)
-    p += min(features.get("congestion_index", 0.2) * 0.3, 0.30)
-    p -= max(0.0, (features.get("carrier_reliability", 0.7) - 0.7))  # better carrier reduces risk
-    return max(0.0, min(p, 0.99))
-
-# -------- ML model predictor via Hugging Face --------
-def ml_score(features: dict) -> float | None:
+    return float(baseline_scores([features])[0])
+
+def remote_scores(features: list[dict]) -> list[float] | None:
+    """Delay probabilities from the Hugging Face Space, or None if it is unavailable."""
+    if not RISK_REMOTE_FALLBACK or not remote_breaker.allow():
+        return None
 
+    start = time.monotonic()
     try:
-        response = requests.post(
-            HF_API_URL,
+        response = http_client.post(
+            f"{HF_API_URL}/predict_batch",
             json={"inputs": features},
-            timeout=10,
+            timeout=remote_breaker.latency_budget,
+            retries=0,
         )
         response.raise_for_status()
         result = response.json()
-
-        # Expected HF format: {"delay_prob": 0.04, "risk_level": "LOW"}
-        if isinstance(result, dict) and "delay_prob" in result:
-            return {
-                "ml_delay_prob": float(result["delay_prob"]),
-                "ml_risk_level": result.get("risk_level", "UNKNOWN"),
-            }
-
+        # Expected HF format: [{"delay_prob": 0.04, "risk_level": "LOW"}, ...]
+        if not isinstance(result, list) or len(result) != len(features):
+            raise ValueError(f"unexpected response: {str(result)[:200]}")
+        probs = [float(r["delay_prob"]) for r in result]
     except Exception as e:
         print("HF request failed:", e)
+        remote_breaker.record(False)
         return None
 
-    return None
+    remote_breaker.record(True, time.monotonic() - start)
+    return probs
+
+def ml_scores(features: list[dict]) -> list[float] | None:
+    """ML delay probability for N feature dicts: local model first, remote as fallback."""
+    if model is not None:
+        try:
+            X = np.column_stack([_column(features, name, default) for name, default in ML_FEATURES])
+            return model.predict_proba(X)[:, 1].tolist()
+        except (TypeError, ValueError) as e:
+            print("Local scoring failed:", e)
+    return remote_scores(features)
+
+def ml_score(features: dict) -> float | None:
+    probs = ml_scores([features])
+    return probs[0] if probs else None
 
 # -------- Unified risk function --------
-def add_risk(shipment: dict) -> dict:
-    f = shipment.get("features", {})
+def score_features(features: list[dict]) -> list[tuple[float, float | None]]:
+    """(baseline, ML) probabilities per feature dict, scoring each uncached feature vector once."""
+    scores = [None] * len(features)
+    pending = {}  # cache key (or row index when not cacheable) -> rows sharing it
+    for i, f in enumerate(features):
+        key = risk_cache.key(f)
+        hit = risk_cache.get(key) if key not in pending else None
+        if hit is not None:
+            scores[i] = hit
+        else:
+            pending.setdefault(key if key is not None else i, []).append(i)
+
+    if pending:
+        rows = [features[idx[0]] for idx in pending.values()]
+        base = baseline_scores(rows)
+        ml = ml_scores(rows)
+        for j, (key, idx) in enumerate(pending.items()):
+            score = (float(base[j]), float(ml[j]) if ml is not None else None)
+            # Baseline-only scores are not cached so the ML score is picked up once it is back
+            if score[1] is not None and isinstance(key, tuple):
+                risk_cache.set(key, score)
+            for i in idx:
+                scores[i] = score
+    return scores
 
-    # Compute both
-    base_prob = baseline_score(f)
-    ml_prob = ml_score(f)["ml_delay_prob"]
+def add_risk(shipment: dict) -> dict:
+    base_prob, ml_prob = score_features([shipment.get("features", {})])[0]
+    return apply_risk(shipment, base_prob, ml_prob)
 
+def apply_risk(shipment: dict, base_prob: float, ml_prob: float | None) -> dict:
     # Choose the larger one
     if ml_prob is not None:
         delay_prob = max(base_prob, ml_prob)
@@ -67,11 +162,36 @@ def add_risk(shipment: dict) -> dict:
     shipment["source"] = source
     return shipment
 
+def add_risk_batch(shipments: list[dict]) -> list[dict]:
+    if not shipments:
+        return []
+    features = [s.get("features", {}) for s in shipments]
+    try:
+        scores = score_features(features)
+    except (TypeError, ValueError):
+        # A malformed feature dict breaks the matrix; score one by one to isolate it
+        return map_batch(add_risk, shipments, max_workers=1)
+
+    return [apply_risk(s, *scores[i]) for i, s in enumerate(shipments)]
+
 @app.get("/health")
 def health():
-    return {"status": "alive"}
+    return {
+        "status": "alive",
+        "model_loaded": model is not None,
+        "remote_fallback": RISK_REMOTE_FALLBACK,
+        "remote_breaker": remote_breaker.stats(),
+        "risk_cache": risk_cache.stats(),
+    }
 
 @app.post("/score")
 async def score_endpoint(request: Request):
-    shipment = await request.json()
-    return add_risk(shipment)
+    shipment = await jsonio.read_json(request)
+    return jsonio.response(await run_in_threadpool(add_risk, shipment))
+
+@app.post("/score_batch")
+async def score_batch_endpoint(request: Request):
+    shipments = await jsonio.read_json(request)
+    before = jsonio.snapshot(request, shipments)
+    results = await run_in_threadpool(add_risk_batch, shipments)
+    return jsonio.response(jsonio.delta(before, results))
@@ -0,0 +1,73 @@
+import re
+import time
+from collections import OrderedDict
+
+# Stands in for the shipment id in cached text, filled in again when served
+ID_PLACEHOLDER = "<shipment_id>"
+
+
+class ExplanationCache:
+    """LRU of explanations with a per-entry TTL.
+
+    Explanations are stored as templates with the shipment id taken out, so an
+    explanation written for one shipment can be served for another one with
+    the same cache key.
+    """
+
+    def __init__(self, maxsize: int = 1000, ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, shipment_id) -> dict | None:
+        item = self._data.get(key)
+        if item is None or item[1] < time.time():
+            self._data.pop(key, None)
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return fill(item[0], shipment_id)
+
+    def set(self, key, explanation: dict, shipment_id):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (template(explanation, shipment_id), time.time() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "size": len(self._data),
+        }
+
+
+def _replace(explanation: dict, replace) -> dict:
+    return {
+        "summary": replace(str(explanation.get("summary", ""))),
+        "actions": [replace(str(a)) for a in explanation.get("actions", [])],
+    }
+
+
+def _id_pattern(shipment_id) -> re.Pattern:
+    # Whole tokens only, so id "7" leaves "73%" or "0.7" alone but still matches "order 7."
+    return re.compile(rf"(?<![\w.-]){re.escape(str(shipment_id))}(?![\w-]|\.\w)")
+
+
+def template(explanation: dict, shipment_id) -> dict:
+    if not shipment_id:
+        return _replace(explanation, lambda text: text)
+    pattern = _id_pattern(shipment_id)
+    return _replace(explanation, lambda text: pattern.sub(ID_PLACEHOLDER, text))
+
+
+def fill(explanation: dict, shipment_id) -> dict:
+    new = str(shipment_id or "N/A")
+    return _replace(explanation, lambda text: text.replace(ID_PLACEHOLDER, new))
@@ -1,9 +1,17 @@
 import os
 import json
+import asyncio
 import google.generativeai as genai
 from fastapi import FastAPI, Request
 from dotenv import load_dotenv
 load_dotenv()
+
+from batching import amap_batch, stage_error
+import jsonio
+import metrics
+from explanation_cache import ExplanationCache, fill, template
+import tracing
+
 # --- Configuration ---
 # Make sure to set your GOOGLE_API_KEY in your environment
 try:
@@ -30,14 +38,36 @@ except Exception as e:
 
 
 app = FastAPI(title="Explanation Agent")
+metrics.instrument(app)
+tracing.instrument(app, "explain")
+
+# Shipments packed into one Gemini prompt by explain_batch (1 = one prompt per shipment)
+EXPLAIN_BATCH_SIZE = max(1, int(os.getenv("EXPLAIN_BATCH_SIZE", "10")))
+# Gemini calls in flight at once, across all requests
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "4"))
+gemini_slots = asyncio.Semaphore(GEMINI_CONCURRENCY)
+# Gemini explanations reused for shipments in the same risk bucket with the same factors
+explanation_cache = ExplanationCache(
+    maxsize=int(os.getenv("EXPLAIN_CACHE_SIZE", "1000")),
+    ttl=float(os.getenv("EXPLAIN_CACHE_TTL", "3600")),
+)
+metrics.track_stats("explanations", explanation_cache.stats)
+# The only shipment fields the LLM needs; route points and raw enrichment are left out
+PROMPT_FIELDS = ("shipment_id", "risk_level", "delay_prob", "features")
+
+# Routing: these risk levels get the rule-based explanation straight away, the others go
+# to Gemini and fall back to the rules if it has not answered within EXPLAIN_LLM_DEADLINE seconds
+EXPLAIN_RULE_LEVELS = {
+    level.strip().upper() for level in os.getenv("EXPLAIN_RULE_LEVELS", "LOW").split(",") if level.strip()
+}
+EXPLAIN_LLM_DEADLINE = float(os.getenv("EXPLAIN_LLM_DEADLINE", "8"))
+# Gemini calls still running after the deadline finish in the background and fill the cache
+background_calls = set()
 
 # --- Default Fallback Logic ---
-# Your original function, renamed to be the default/fallback
-def explain_default(s: dict) -> dict:
-    """The default rule-based explanation logic."""
+def risk_factors(f: dict) -> list[str]:
+    """The conditions that drive a shipment's risk, in a fixed order."""
     parts = []
-    f = s.get("features", {}) # Use .get for safer access
-
     if f.get("origin_storm"):
         parts.append("heavy storm at origin")
     if f.get("origin_rain_mm", 0) > 10:
@@ -46,6 +76,12 @@ def explain_default(s: dict) -> dict:
         parts.append("peak-hour congestion")
     if f.get("distance_km", 0) > 400:
         parts.append("long route distance")
+    return parts
+
+# Your original function, renamed to be the default/fallback
+def explain_default(s: dict) -> dict:
+    """The default rule-based explanation logic."""
+    parts = risk_factors(s.get("features", {})) # Use .get for safer access
     if not parts:
         parts.append("minor traffic and weather factors")
 
@@ -63,62 +99,201 @@ def explain_default(s: dict) -> dict:
     return s
 
 # --- Gemini Logic ---
-async def explain_with_gemini(s: dict) -> dict:
-    """Generates an explanation using the Gemini API."""
+def cache_key(s: dict) -> tuple:
+    """Risk level, 10% probability bucket and contributing factors."""
+    delay_prob = float(s.get("delay_prob", 0))
+    return (s.get("risk_level"), int(delay_prob * 10), tuple(risk_factors(s.get("features", {}))))
+
+def prompt_data(s: dict) -> dict:
+    return {k: s[k] for k in PROMPT_FIELDS if k in s}
+
+def apply_explanation(s: dict, explanation: dict, explained_by: str) -> dict:
+    s["summary"] = explanation.get("summary") or "No summary generated."
+    s["actions"] = explanation.get("actions") or ["No actions generated."]
+    s["explained_by"] = explained_by # Add a field to know who explained it
+    return s
+
+async def explain_with_gemini(shipments: list[dict]) -> list[dict]:
+    """Explains several shipments with one Gemini call; returns one {"summary", "actions"} per shipment, in order."""
     prompt = f"""
     You are a logistics and supply chain analyst. Your task is to analyze shipment data and provide a concise summary and recommended actions.
 
-    Based on the following shipment JSON data, generate a response in a valid JSON format with two keys: "summary" and "actions".
+    Based on the following JSON array of shipments, generate a response in a valid JSON format: an array with exactly one object per shipment, in the same order, each with two keys: "summary" and "actions".
 
     - The 'summary' should be a single, human-readable sentence explaining the risk.
     - The 'actions' should be a JSON array of strings with specific, actionable recommendations.
 
-    Shipment Data:
-    {json.dumps(s, indent=2)}
+    Shipments:
+    {json.dumps([prompt_data(s) for s in shipments], separators=(",", ":"))}
 
     Example Output Format:
-    {{
-      "summary": "Order [shipment_id] has a high risk of delay due to peak-hour congestion and a long route.",
-      "actions": ["Notify customer of possible delay", "Monitor traffic conditions closely"]
-    }}
+    [
+      {{
+        "summary": "Order [shipment_id] has a high risk of delay due to peak-hour congestion and a long route.",
+        "actions": ["Notify customer of possible delay", "Monitor traffic conditions closely"]
+      }}
+    ]
     """
-    
+
+    async with gemini_slots:
+        try:
+            with metrics.UPSTREAM_IN_FLIGHT.track(upstream="gemini"), metrics.UPSTREAM_LATENCY.time(upstream="gemini"), \
+                    tracing.span("gemini generate_content", kind="client", shipments=len(shipments)):
+                response = await model.generate_content_async(prompt)
+        except Exception as e:
+            metrics.UPSTREAM_ERRORS.inc(upstream="gemini", reason=type(e).__name__)
+            raise
+    # The API returns a JSON string, so we need to parse it
+    results = json.loads(response.text)
+    if isinstance(results, dict) and len(shipments) == 1:
+        results = [results]
+    if not isinstance(results, list) or len(results) != len(shipments):
+        raise ValueError(f"expected {len(shipments)} explanations, got {str(results)[:200]}")
+    return [r if isinstance(r, dict) else {} for r in results]
+
+async def gemini_group(keys: list, groups: dict) -> dict:
+    """One Gemini call for the first shipment of each group; returns {key: template} and caches it.
+
+    The templates have the first shipment's id taken out, so fill() gives every group member its own.
+    """
+    firsts = [groups[key][0] for key in keys]
     try:
-        response = await model.generate_content_async(prompt)
-        # The API returns a JSON string, so we need to parse it
-        gemini_result = json.loads(response.text)
-        
-        # Merge Gemini's output back into the original shipment dictionary
-        s["summary"] = gemini_result.get("summary", "No summary generated.")
-        s["actions"] = gemini_result.get("actions", ["No actions generated."])
-        s["explained_by"] = "gemini" # Add a field to know who explained it
-        return s
+        results = await explain_with_gemini(firsts)
     except Exception as e:
         print(f"Gemini API call failed: {e}")
-        # Re-raise the exception to be caught by the endpoint's try/except block
-        raise
+        return {}
+
+    templates = {}
+    for key, first, result in zip(keys, firsts, results):
+        explanation_cache.set(key, result, first.get("shipment_id"))
+        templates[key] = template(result, first.get("shipment_id"))
+    return templates
+
+async def explain_many(shipments: list[dict], deadline: float | None = None):
+    """Explains shipments in place with Gemini, in prompts of EXPLAIN_BATCH_SIZE.
+
+    Cached explanations are used directly. Shipments Gemini has not explained
+    within `deadline` seconds (None = no limit) get the default explanation.
+    """
+    groups = {}
+    for s in shipments:
+        key = cache_key(s)
+        cached = explanation_cache.get(key, s.get("shipment_id")) if key not in groups else None
+        if cached is not None:
+            apply_explanation(s, cached, "gemini_cache")
+        else:
+            groups.setdefault(key, []).append(s)
+    if not groups:
+        return
+
+    keys = list(groups)
+    calls = [
+        asyncio.ensure_future(gemini_group(keys[i:i + EXPLAIN_BATCH_SIZE], groups))
+        for i in range(0, len(keys), EXPLAIN_BATCH_SIZE)
+    ]
+    done, pending = await asyncio.wait(calls, timeout=deadline)
+    for call in pending:
+        background_calls.add(call)
+        call.add_done_callback(background_calls.discard)
+    if pending:
+        print(f"Gemini missed the {deadline}s deadline for {len(pending)} prompt(s), using default explanations")
+
+    results = {}
+    for call in done:
+        results.update(call.result())
+    for key, group in groups.items():
+        if key not in results:
+            # Fallback to default logic if Gemini failed or was too slow
+            for s in group:
+                explain_default(s)["explained_by"] = "default_fallback"
+            continue
+        apply_explanation(group[0], fill(results[key], group[0].get("shipment_id")), "gemini")
+        for s in group[1:]:
+            apply_explanation(s, fill(results[key], s.get("shipment_id")), "gemini_cache")
+
+def risk_level(s: dict) -> str:
+    if s.get("risk_level"):
+        return str(s["risk_level"]).upper()
+    delay_prob = float(s.get("delay_prob", 0))
+    return "HIGH" if delay_prob >= 0.6 else "MEDIUM" if delay_prob >= 0.3 else "LOW"
+
+def use_gemini(s: dict) -> bool:
+    return GEMINI_AVAILABLE and risk_level(s) not in EXPLAIN_RULE_LEVELS
+
+def explain_rules(s: dict) -> dict:
+    response = explain_default(s)
+    response["explained_by"] = "default"
+    return response
+
+async def explain(shipment: dict) -> dict:
+    # Gemini only where it adds value, within the deadline
+    if use_gemini(shipment):
+        await explain_many([shipment], EXPLAIN_LLM_DEADLINE)
+        return shipment
+    return explain_rules(shipment)
+
+async def explain_batch(shipments: list[dict]) -> list[dict]:
+    results, for_gemini = [], []
+    for s in shipments:
+        try:
+            if use_gemini(s):
+                cache_key(s)
+                for_gemini.append(s)
+            else:
+                explain_rules(s)
+        except Exception as e:
+            results.append(stage_error(s, e))
+            continue
+        results.append(s)
+    await explain_many(for_gemini, EXPLAIN_LLM_DEADLINE)
+    return results
+
+async def upgrade_batch(shipments: list[dict]) -> list[dict]:
+    """Gemini explanations for any risk level and without the deadline, e.g. to replace a default one later."""
+    if not GEMINI_AVAILABLE:
+        return await amap_batch(explain, shipments)
+
+    results, explainable = [], []
+    for s in shipments:
+        try:
+            cache_key(s)
+        except Exception as e:
+            results.append(stage_error(s, e))
+            continue
+        results.append(s)
+        explainable.append(s)
+    await explain_many(explainable)
+    return results
 
 # --- API Endpoints ---
 @app.get("/health")
 def health():
-    return {"status": "alive", "gemini_available": GEMINI_AVAILABLE}
+    return {
+        "status": "alive",
+        "gemini_available": GEMINI_AVAILABLE,
+        "gemini_concurrency": GEMINI_CONCURRENCY,
+        "explain_batch_size": EXPLAIN_BATCH_SIZE,
+        "explanation_cache": explanation_cache.stats(),
+        "rule_levels": sorted(EXPLAIN_RULE_LEVELS),
+        "llm_deadline": EXPLAIN_LLM_DEADLINE,
+        "background_calls": len(background_calls),
+    }
 
 @app.post("/explain")
 async def explain_endpoint(request: Request):
-    shipment = await request.json()
-    # Try to use Gemini first if it's available
-    if GEMINI_AVAILABLE:
-        try:
-            print("Gemini")
-            return await explain_with_gemini(shipment)
-        except Exception as e:
-            print(f"Switching to default explanation due to Gemini failure: {e}")
-            # Fallback to default logic if Gemini fails
-            response = explain_default(shipment)
-            response["explained_by"] = "default_fallback"
-            return response
-    else:
-        # Use default logic if Gemini was never configured
-        response = explain_default(shipment)
-        response["explained_by"] = "default"
-        return response
\ No newline at end of file
+    shipment = await jsonio.read_json(request)
+    return jsonio.response(await explain(shipment))
+
+@app.post("/explain_batch")
+async def explain_batch_endpoint(request: Request):
+    shipments = await jsonio.read_json(request)
+    before = jsonio.snapshot(request, shipments)
+    return jsonio.response(jsonio.delta(before, await explain_batch(shipments)))
+
+@app.post("/explain_upgrade")
+async def explain_upgrade_endpoint(request: Request):
+    """Takes a shipment or a list of shipments (e.g. ones explained by "default"), returns them explained by Gemini."""
+    body = await jsonio.read_json(request)
+    if isinstance(body, dict):
+        return jsonio.response((await upgrade_batch([body]))[0])
+    return jsonio.response(await upgrade_batch(body))
@@ -1,7 +1,14 @@
 # Console  notification
 from fastapi import FastAPI, Request
 
+from batching import map_batch
+import jsonio
+import metrics
+import tracing
+
 app = FastAPI(title="Notification Agent")
+metrics.instrument(app)
+tracing.instrument(app, "notify")
 
 def notify(s: dict) -> dict:
     level = s.get("risk_level", "LOW")
@@ -17,11 +24,20 @@ def notify(s: dict) -> dict:
     s["notification"] = message
     return s
 
+def notify_batch(shipments: list[dict]) -> list[dict]:
+    return map_batch(notify, shipments, max_workers=1)
+
 @app.get("/health")
 def health():
     return {"status": "alive"}
 
 @app.post("/notify")
 async def notify_endpoint(request: Request):
-    shipment = await request.json()
-    return notify(shipment)
+    shipment = await jsonio.read_json(request)
+    return jsonio.response(notify(shipment))
+
+@app.post("/notify_batch")
+async def notify_batch_endpoint(request: Request):
+    shipments = await jsonio.read_json(request)
+    before = jsonio.snapshot(request, shipments)
+    return jsonio.response(jsonio.delta(before, notify_batch(shipments)))
@@ -0,0 +1,65 @@
+"""Compare two benchmark files written by run.py.
+
+    python benchmarks/compare.py baseline.json candidate.json --threshold 0.1
+
+Prints throughput, p95 latency and peak memory per batch size and exits with
+1 when the candidate's throughput is lower, or its p95 higher, than the
+baseline's by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+
+def change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) / old
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed relative regression (0.1 = 10%%)")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    for key in ("mode", "profile", "lanes", "seed"):
+        if baseline["meta"].get(key) != candidate["meta"].get(key):
+            print(f"warning: {key} differs between the runs, the numbers are not comparable")
+
+    old_rows = {row["batch_size"]: row for row in baseline["summary"]}
+    regressions = []
+    print(f"{'size':>6}  {'throughput/s':>24}  {'p95 latency s':>24}  {'peak MB':>16}")
+    for new in candidate["summary"]:
+        size = new["batch_size"]
+        old = old_rows.get(size)
+        if old is None:
+            continue
+        throughput = change(old["throughput_per_s"], new["throughput_per_s"])
+        p95 = change(old["latency_seconds"]["p95"], new["latency_seconds"]["p95"])
+        print(
+            f"{size:>6}  {old['throughput_per_s']:>9} -> {new['throughput_per_s']:>9} {_pct(throughput)}"
+            f"  {old['latency_seconds']['p95']!s:>9} -> {new['latency_seconds']['p95']!s:>9} {_pct(p95)}"
+            f"  {old['peak_memory_mb']!s:>7} -> {new['peak_memory_mb']!s:>7}"
+        )
+        if throughput is not None and throughput < -args.threshold:
+            regressions.append(f"{size}: throughput {_pct(throughput).strip()}")
+        if p95 is not None and p95 > args.threshold:
+            regressions.append(f"{size}: p95 {_pct(p95).strip()}")
+
+    if regressions:
+        print("Regressions: " + "; ".join(regressions))
+        sys.exit(1)
+
+
+def _pct(value) -> str:
+    return f"{value:+6.1%}" if value is not None else "     -"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Local stand-ins for the external APIs the agents call.
+
+One FastAPI app serves the TomTom geocode, routing and traffic flow
+endpoints, Open-Meteo's forecast endpoint and the Hugging Face Space's
+/predict_batch. FakeGemini replaces the explanation agent's Gemini model.
+Answers are derived from the request (a hash of the city name, the route
+end points, ...), so every run sees the same data.
+
+Each upstream has a profile of latency and jitter (seconds) and an
+error_rate; failed calls get a 503, which http_client retries like the real
+thing.
+
+    python benchmarks/mocks.py --port 9100 --profile '{"tomtom": {"latency": 0.08}}'
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+
+from fastapi import FastAPI, HTTPException, Request
+
+UPSTREAMS = ("tomtom", "open_meteo", "huggingface", "gemini")
+DEFAULT_PROFILE = {
+    "tomtom": {"latency": 0.08, "jitter": 0.04, "error_rate": 0.0},
+    "open_meteo": {"latency": 0.05, "jitter": 0.02, "error_rate": 0.0},
+    "huggingface": {"latency": 0.15, "jitter": 0.05, "error_rate": 0.0},
+    "gemini": {"latency": 1.5, "jitter": 0.5, "error_rate": 0.0},
+}
+ROUTE_POINTS = 200
+
+
+def build_profile(latency=None, jitter=None, error_rate=None, overrides: dict | None = None) -> dict:
+    """DEFAULT_PROFILE with global values applied to every upstream, then per-upstream overrides."""
+    profile = {}
+    for name in UPSTREAMS:
+        settings = dict(DEFAULT_PROFILE[name])
+        for key, value in (("latency", latency), ("jitter", jitter), ("error_rate", error_rate)):
+            if value is not None:
+                settings[key] = value
+        settings.update((overrides or {}).get(name, {}))
+        profile[name] = settings
+    return profile
+
+
+class Fault:
+    """Latency, jitter and errors of one upstream."""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+
+    def delay(self) -> float:
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay())
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            raise HTTPException(status_code=503, detail="injected failure")
+
+
+def _unit(*parts) -> float:
+    """Deterministic number in [0, 1) for the given inputs."""
+    digest = hashlib.sha1("|".join(str(p) for p in parts).encode()).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+def city_position(name: str) -> dict:
+    # Spread cities over East Africa (roughly the region the sample data uses)
+    return {"lat": round(-4.5 + 9 * _unit("lat", name.upper()), 6), "lon": round(29.5 + 12 * _unit("lon", name.upper()), 6)}
+
+
+def create_app(profile: dict | None = None, seed: int = 0) -> FastAPI:
+    profile = profile or build_profile()
+    faults = {name: Fault(**profile[name], seed=seed + i) for i, name in enumerate(UPSTREAMS) if name != "gemini"}
+    app = FastAPI(title="CargoSense mock upstreams")
+
+    @app.get("/health")
+    def health():
+        return {"status": "alive", "calls": {n: f.calls for n, f in faults.items()},
+                "errors": {n: f.errors for n, f in faults.items()}}
+
+    @app.get("/search/2/geocode/{query}.json")
+    async def geocode(query: str):
+        await faults["tomtom"]()
+        return {"results": [{"position": city_position(query)}]}
+
+    @app.get("/routing/1/calculateRoute/{locations}/json")
+    async def route(locations: str):
+        await faults["tomtom"]()
+        (lat1, lon1), (lat2, lon2) = [map(float, point.split(",")) for point in locations.split(":")[:2]]
+        points = [
+            {"latitude": lat1 + (lat2 - lat1) * i / (ROUTE_POINTS - 1), "longitude": lon1 + (lon2 - lon1) * i / (ROUTE_POINTS - 1)}
+            for i in range(ROUTE_POINTS)
+        ]
+        # ~111 km per degree, with a detour factor, at 50-70 km/h
+        length = int(((lat2 - lat1) ** 2 + (lon2 - lon1) ** 2) ** 0.5 * 111_000 * 1.3)
+        speed = 50 + 20 * _unit("speed", locations)
+        return {"routes": [{
+            "summary": {"lengthInMeters": length, "travelTimeInSeconds": int(length / (speed / 3.6))},
+            "legs": [{"points": points}],
+        }]}
+
+    @app.get("/traffic/services/4/flowSegmentData/absolute/10/json")
+    async def traffic_flow(point: str):
+        await faults["tomtom"]()
+        free = 60 + int(40 * _unit("free", point))
+        return {"flowSegmentData": {"currentSpeed": int(free * (0.3 + 0.7 * _unit("current", point))), "freeFlowSpeed": free}}
+
+    @app.get("/v1/forecast")
+    async def forecast(latitude: str, longitude: str):
+        await faults["open_meteo"]()
+        locations = [
+            {"hourly": {
+                "precipitation": [round(20 * _unit("rain", lat, lon, h) ** 3, 2) for h in range(24)],
+                "wind_speed_10m": [round(60 * _unit("wind", lat, lon, h) ** 2, 1) for h in range(24)],
+            }}
+            for lat, lon in zip(latitude.split(","), longitude.split(","))
+        ]
+        return locations if len(locations) > 1 else locations[0]
+
+    @app.post("/predict_batch")
+    async def predict_batch(request: Request):
+        await faults["huggingface"]()
+        body = await request.json()
+        results = []
+        for features in body["inputs"]:
+            prob = round(_unit("risk", json.dumps(features, sort_keys=True)), 3)
+            results.append({"delay_prob": prob, "risk_level": "HIGH" if prob >= 0.6 else "MEDIUM" if prob >= 0.3 else "LOW"})
+        return results
+
+    return app
+
+
+class FakeGemini:
+    """Drop-in for genai.GenerativeModel in the explanation agent."""
+
+    class Response:
+        def __init__(self, text: str):
+            self.text = text
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.fault = Fault(latency, jitter, error_rate, seed)
+
+    async def generate_content_async(self, prompt: str):
+        self.fault.calls += 1
+        await asyncio.sleep(self.fault.delay())
+        if self.fault.random.random() < self.fault.error_rate:
+            self.fault.errors += 1
+            raise RuntimeError("injected Gemini failure")
+        # The prompt embeds the shipments as a one-line JSON array after "Shipments:"
+        shipments = json.loads(prompt.split("Shipments:", 1)[1].strip().splitlines()[0])
+        return self.Response(json.dumps([
+            {"summary": "Benchmark explanation.", "actions": ["Monitor closely"]} for _ in shipments
+        ]))
+
+
+def install_fake_gemini(module, profile: dict, seed: int = 0):
+    """Point an imported explanation agent at FakeGemini."""
+    module.model = FakeGemini(**profile["gemini"], seed=seed)
+    module.GEMINI_AVAILABLE = True
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--profile", default="{}", help="JSON overrides, e.g. '{\"tomtom\": {\"error_rate\": 0.01}}'")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    app = create_app(build_profile(overrides=json.loads(args.profile)), seed=args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,365 @@
+"""Benchmark the full pipeline against local stand-ins for TomTom, Open-Meteo,
+Hugging Face and Gemini (see mocks.py).
+
+    python benchmarks/run.py                                  # in-process, 1..10k shipments
+    python benchmarks/run.py --mode uvicorn --sizes 1,100,1000 --repeat 5
+    python benchmarks/run.py --latency 0.2 --error-rate 0.02 --set gemini.latency=3
+
+"inprocess" imports the orchestrator with every stage in STAGE_MODE=local and
+calls it over ASGI; "uvicorn" starts the orchestrator and the eight agents as
+local uvicorn processes that talk over HTTP like the deployed services. The
+mocks always run in their own process.
+
+Every batch goes to POST /cargosense?timings=true. The output file holds one
+row per run (wall time, throughput, per-shipment latency percentiles from the
+timings, per-stage percentiles, memory of each process) and a summary per
+batch size; compare two of them with compare.py. Caches start empty and stay
+warm between runs, in the same order every time.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+
+from mocks import build_profile, install_fake_gemini
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+ORCHESTRATOR_DIR = ROOT / "cargosense_orchestrator"
+
+# stage -> (agent folder, endpoint the orchestrator calls with "_batch" appended)
+AGENTS = {
+    "ingestion": ("agents/1_ingestion", "/ingest"),
+    "geocode": ("agents/2_geocode_route", "/geocode_enrich"),
+    "weather": ("agents/3_weather", "/enrich_weather"),
+    "traffic": ("agents/4_traffic", "/enrich_congestion"),
+    "features": ("agents/5_feature_builder", "/build_features"),
+    "risk": ("agents/6_riskmodel_randomForest", "/score"),
+    "explain": ("agents/7_explanation", "/explain"),
+    "notify": ("agents/8_notify", "/notify"),
+}
+
+CITIES = [
+    "Nairobi", "Mombasa", "Kisumu", "Nakuru", "Eldoret", "Thika", "Malindi", "Kitale", "Garissa", "Kakamega",
+    "Nyeri", "Machakos", "Meru", "Kericho", "Naivasha", "Embu", "Isiolo", "Lamu", "Voi", "Narok",
+    "Kampala", "Entebbe", "Jinja", "Gulu", "Mbarara", "Kigali", "Dar es Salaam", "Arusha", "Dodoma", "Mwanza",
+    "Moshi", "Tanga", "Addis Ababa", "Juba", "Bujumbura", "Goma", "Kisii", "Bungoma", "Busia", "Namanga",
+]
+CARRIERS = ["DHL", "UPS", "FedEx", "Posta", "G4S"]
+DISPATCH_BASE = datetime(2025, 1, 6, 8, tzinfo=timezone.utc)
+
+
+def make_shipments(n: int, seed: int, lanes: int, prefix: str = "BENCH") -> list[dict]:
+    """n shipments spread over `lanes` origin/destination pairs, the same for the same seed."""
+    rng = random.Random(seed)
+    pairs = []
+    while len(pairs) < lanes:
+        origin, destination = rng.sample(CITIES, 2)
+        pairs.append((origin, destination))
+    shipments = []
+    for i in range(n):
+        origin, destination = pairs[rng.randrange(lanes)]
+        dispatch = DISPATCH_BASE + timedelta(hours=rng.randrange(24 * 30))
+        shipments.append({
+            "shipment_id": f"{prefix}-{seed}-{i}",
+            "origin": origin,
+            "destination": destination,
+            "carrier": rng.choice(CARRIERS),
+            "dispatch_ts": dispatch.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "expected_ts": (dispatch + timedelta(hours=rng.randint(4, 96))).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        })
+    return shipments
+
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(values)
+
+    def at(q):
+        position = (len(ordered) - 1) * q
+        low = int(position)
+        high = min(low + 1, len(ordered) - 1)
+        return round(ordered[low] + (ordered[high] - ordered[low]) * (position - low), 6)
+
+    return {"p50": at(0.5), "p95": at(0.95), "p99": at(0.99), "max": round(ordered[-1], 6)}
+
+
+# -------- Memory (Linux /proc; None elsewhere) --------
+def _proc_status(pid: int) -> dict:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return {}
+    return {k: int(fields[k].split()[0]) / 1024 for k in ("VmRSS", "VmHWM") if k in fields}
+
+
+def reset_peak(pid: int) -> bool:
+    """Reset the process's peak RSS (VmHWM) so the next reading covers one run."""
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def memory(pids: dict) -> dict:
+    readings = {}
+    for name, pid in pids.items():
+        status = _proc_status(pid)
+        readings[name] = {"rss_mb": round(status["VmRSS"], 1) if "VmRSS" in status else None,
+                          "peak_mb": round(status["VmHWM"], 1) if "VmHWM" in status else None}
+    return readings
+
+
+# -------- Processes --------
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def upstream_env(mock_url: str) -> dict:
+    return {
+        "TOMTOM": "benchmark",
+        "TOMTOM_BASE_URL": mock_url,
+        "OPEN_METEO_URL": f"{mock_url}/v1/forecast",
+        "HF_API_URL": mock_url,
+        "GOOGLE_API_KEY": "benchmark",
+        # Start every benchmark with empty caches and no background work
+        "GEOCODE_CACHE_PATH": "",
+        "WEATHER_TILE_PATH": "",
+        "WEATHER_PREFETCH_TOP": "0",
+        "JOB_BACKEND": "memory",
+    }
+
+
+class Processes:
+    """Child processes with their output in a log folder; all stopped on exit."""
+
+    def __init__(self):
+        self.log_dir = Path(tempfile.mkdtemp(prefix="cargosense-bench-"))
+        self.children = {}
+
+    def start(self, name: str, args: list, env: dict, port: int) -> str:
+        log = open(self.log_dir / f"{name}.log", "w")
+        proc = subprocess.Popen([sys.executable, *args], env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT)
+        self.children[name] = (proc, log)
+        return f"http://127.0.0.1:{port}"
+
+    def wait_ready(self, urls: dict, timeout: float = 60):
+        deadline = time.monotonic() + timeout
+        pending = dict(urls)
+        while pending:
+            for name, url in list(pending.items()):
+                proc = self.children[name][0]
+                if proc.poll() is not None:
+                    raise RuntimeError(f"{name} exited with {proc.returncode}, see {self.log_dir / (name + '.log')}")
+                try:
+                    if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                        del pending[name]
+                except httpx.HTTPError:
+                    pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{', '.join(pending)} not ready after {timeout}s, logs in {self.log_dir}")
+            time.sleep(0.2)
+
+    def pids(self) -> dict:
+        return {name: proc.pid for name, (proc, _) in self.children.items()}
+
+    def stop(self):
+        for proc, log in self.children.values():
+            proc.terminate()
+        for proc, log in self.children.values():
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            log.close()
+
+
+# -------- Measurement --------
+async def run_batch(client: httpx.AsyncClient, shipments: list[dict], pids: dict) -> dict:
+    peak_reset = all([reset_peak(pid) for pid in pids.values()])
+    start = time.perf_counter()
+    resp = await client.post("/cargosense", params={"timings": "true"}, json=shipments)
+    wall = time.perf_counter() - start
+    resp.raise_for_status()
+    body = resp.json()
+
+    processed = body["processed_shipments"]
+    stage_times = {}
+    for shipment in processed:
+        for stage, seconds in shipment.get("timings", {}).items():
+            if stage != "total":
+                stage_times.setdefault(stage, []).append(seconds)
+    return {
+        "batch_size": len(shipments),
+        "wall_seconds": round(wall, 4),
+        "throughput_per_s": round(len(shipments) / wall, 2),
+        "processed": len(processed),
+        "errors": len(body["errors"]),
+        "latency_seconds": percentiles([s["timings"]["total"] for s in processed if "timings" in s]),
+        "stage_seconds": {stage: percentiles(values) for stage, values in stage_times.items()},
+        "memory_mb": memory(pids),
+        "peak_reset": peak_reset,
+        "_totals": [s["timings"]["total"] for s in processed if "timings" in s],
+    }
+
+
+async def measure(client: httpx.AsyncClient, args, pids: dict) -> list[dict]:
+    # Warm-up: imports, connection pools, the risk model
+    await run_batch(client, make_shipments(1, -1, 1, prefix="WARMUP"), pids)
+    rows = []
+    for size in args.sizes:
+        for repeat in range(args.repeat):
+            row = await run_batch(client, make_shipments(size, args.seed + repeat, args.lanes), pids)
+            row["repeat"] = repeat
+            rows.append(row)
+            print(
+                f"{size:>6} shipments  run {repeat + 1}/{args.repeat}  {row['wall_seconds']:8.3f}s  "
+                f"{row['throughput_per_s']:9.1f}/s  p95 {row['latency_seconds']['p95']}s  errors {row['errors']}",
+                flush=True,
+            )
+    return rows
+
+
+def summarize(rows: list[dict]) -> list[dict]:
+    summary = []
+    for size in dict.fromkeys(row["batch_size"] for row in rows):
+        runs = [row for row in rows if row["batch_size"] == size]
+        totals = [t for row in runs for t in row.pop("_totals")]
+        peaks = [
+            sum(m["peak_mb"] for m in row["memory_mb"].values() if m["peak_mb"] is not None) for row in runs
+        ]
+        summary.append({
+            "batch_size": size,
+            "runs": len(runs),
+            "throughput_per_s": percentiles([row["throughput_per_s"] for row in runs])["p50"],
+            "wall_seconds": percentiles([row["wall_seconds"] for row in runs])["p50"],
+            "latency_seconds": percentiles(totals),
+            "errors": sum(row["errors"] for row in runs),
+            "peak_memory_mb": round(max(peaks), 1) if peaks else None,
+        })
+    return summary
+
+
+async def run_inprocess(args, mock_url: str, profile: dict) -> list[dict]:
+    os.environ.update(upstream_env(mock_url))
+    os.environ["STAGE_MODE"] = "local"
+    sys.path.insert(0, str(ORCHESTRATOR_DIR))
+    import main as orchestrator
+
+    async with orchestrator.app.router.lifespan_context(orchestrator.app):
+        install_fake_gemini(orchestrator.local_stages.load("explain"), profile, seed=args.seed)
+        transport = httpx.ASGITransport(app=orchestrator.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://orchestrator", timeout=None) as client:
+            return await measure(client, args, {"orchestrator": os.getpid()})
+
+
+async def run_uvicorn(args, procs: Processes, mock_url: str, profile: dict) -> list[dict]:
+    env = upstream_env(mock_url)
+    profile_arg = ["--profile", json.dumps(profile), "--seed", str(args.seed)]
+    urls, stage_urls = {}, {}
+    for stage, (folder, path) in AGENTS.items():
+        port = free_port()
+        urls[stage] = procs.start(stage, [str(BENCH_DIR / "serve.py"), str(ROOT / folder), "--port", str(port), *profile_arg], env, port)
+        stage_urls[f"STAGE_URL_{stage.upper()}"] = urls[stage] + path
+    procs.wait_ready(urls)
+
+    port = free_port()
+    urls = {"orchestrator": procs.start(
+        "orchestrator", [str(BENCH_DIR / "serve.py"), str(ORCHESTRATOR_DIR), "--port", str(port)],
+        {**env, **stage_urls, "STAGE_MODE": "remote"}, port,
+    )}
+    procs.wait_ready(urls)
+    pids = {name: pid for name, pid in procs.pids().items() if name != "mocks"}
+    async with httpx.AsyncClient(base_url=urls["orchestrator"], timeout=None) as client:
+        return await measure(client, args, pids)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_overrides(values: list[str]) -> dict:
+    """["gemini.latency=3", "tomtom.error_rate=0.05"] -> {"gemini": {"latency": 3.0}, ...}"""
+    overrides = {}
+    for value in values:
+        key, _, number = value.partition("=")
+        upstream, _, field = key.partition(".")
+        overrides.setdefault(upstream, {})[field] = float(number)
+    return overrides
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn"], default="inprocess")
+    parser.add_argument("--sizes", default="1,10,100,1000,10000", help="comma-separated batch sizes")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per batch size")
+    parser.add_argument("--lanes", type=int, default=200, help="distinct origin/destination pairs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, help="mean latency (s) of every mocked upstream")
+    parser.add_argument("--jitter", type=float, help="+/- jitter (s) of every mocked upstream")
+    parser.add_argument("--error-rate", type=float, help="share of mocked calls that fail with 503")
+    parser.add_argument("--set", action="append", default=[], metavar="UPSTREAM.FIELD=VALUE",
+                        help="per-upstream setting, e.g. gemini.latency=3 (tomtom, open_meteo, huggingface, gemini)")
+    parser.add_argument("--output", default="benchmark.json")
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(",")]
+
+    profile = build_profile(args.latency, args.jitter, args.error_rate, parse_overrides(args.set))
+    procs = Processes()
+    try:
+        port = free_port()
+        mock_url = procs.start(
+            "mocks", [str(BENCH_DIR / "mocks.py"), "--port", str(port), "--profile", json.dumps(profile), "--seed", str(args.seed)],
+            {}, port,
+        )
+        procs.wait_ready({"mocks": mock_url})
+        if args.mode == "inprocess":
+            rows = asyncio.run(run_inprocess(args, mock_url, profile))
+        else:
+            rows = asyncio.run(run_uvicorn(args, procs, mock_url, profile))
+    finally:
+        procs.stop()
+
+    report = {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "mode": args.mode,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "seed": args.seed,
+            "lanes": args.lanes,
+            "repeat": args.repeat,
+            "profile": profile,
+            "env": {k: os.environ[k] for k in ("BATCH_SIZE", "STAGE_CONCURRENCY", "BATCH_WORKERS") if k in os.environ},
+        },
+        "summary": summarize(rows),
+        "runs": rows,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
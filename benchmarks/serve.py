@@ -0,0 +1,39 @@
+"""Serve one CargoSense service (the orchestrator or an agent) under uvicorn.
+
+Used by run.py in uvicorn mode. Imports <service dir>/main.py the way the
+service's own deployment does; for the explanation agent the Gemini model is
+replaced with mocks.FakeGemini.
+
+    python benchmarks/serve.py agents/3_weather --port 9103
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+import uvicorn
+
+BENCH_DIR = Path(__file__).resolve().parent
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("service_dir")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--profile", default="{}", help="mock profile (JSON), for the explanation agent's FakeGemini")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    service_dir = Path(args.service_dir).resolve()
+    os.chdir(service_dir)
+    sys.path.insert(0, str(service_dir))
+    import main
+
+    if hasattr(main, "explain_with_gemini"):
+        sys.path.insert(0, str(BENCH_DIR))
+        from mocks import build_profile, install_fake_gemini
+
+        install_fake_gemini(main, build_profile(overrides=json.loads(args.profile)), seed=args.seed)
+
+    uvicorn.run(main.app, host=args.host, port=args.port, log_level="warning")
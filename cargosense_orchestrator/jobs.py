@@ -0,0 +1,221 @@
+"""Background jobs for large shipment batches.
+
+A job is submitted with a list of shipments and gets an id straight away.
+JOB_WORKERS jobs run through the pipeline at a time; the rest wait in line.
+With a QueueRunner (JOB_BACKEND=queue) shipments go into the durable work
+queue instead, and unfinished jobs are picked up again after a restart.
+Every shipment that leaves the chain is appended to the job's event log, so
+clients can poll progress or stream results as they arrive, replaying from
+the start when they connect late.
+"""
+import asyncio
+import os
+import time
+import uuid
+
+import tracing
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Finished jobs are kept this many seconds, and at most JOB_RETENTION of them
+JOB_TTL = float(os.getenv("JOB_TTL", "3600"))
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", "100"))
+
+
+class Job:
+    def __init__(self, shipments: list[dict], job_id: str | None = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.shipments = shipments
+        self.total = len(shipments)
+        self.status = "queued"
+        self.detail = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.completed = 0
+        self.failed = 0
+        # The job's spans continue the trace of the request that submitted it
+        self.trace = tracing.current()
+        # ("result", {"index", "shipment"}) / ("error", error) / ("done", summary), in arrival order
+        self.events = []
+        # Set (and replaced) whenever an event is appended, waking every streaming client
+        self._appended = asyncio.Event()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def _notify(self):
+        appended, self._appended = self._appended, asyncio.Event()
+        appended.set()
+
+    def add_result(self, index: int, record: dict):
+        self.completed += 1
+        self.events.append(("result", {"index": index, "shipment": record}))
+        self._notify()
+
+    def add_error(self, error: dict):
+        self.failed += 1
+        self.events.append(("error", error))
+        self._notify()
+
+    def finish_if_complete(self):
+        if not self.is_finished and self.completed + self.failed >= self.total:
+            self.finish("done")
+
+    def finish(self, status: str, detail: str | None = None):
+        self.status = status
+        self.detail = detail
+        self.finished = time.time()
+        self.shipments = None
+        self.events.append(("done", self.summary()))
+        self._notify()
+
+    def summary(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "detail": self.detail,
+            "total": self.total,
+            "completed": self.completed,
+            "failed": self.failed,
+            "pending": self.total - self.completed - self.failed,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "trace_id": self.trace[0] if self.trace else None,
+        }
+
+    def results(self) -> dict:
+        done = sorted((e for kind, e in self.events if kind == "result"), key=lambda e: e["index"])
+        errors = sorted((e for kind, e in self.events if kind == "error"), key=lambda e: e["index"])
+        return {"processed_shipments": [e["shipment"] for e in done], "errors": errors}
+
+    async def stream(self):
+        """Yield (kind, payload) events from the first one, waiting for new ones until the job ends."""
+        position = 0
+        while True:
+            appended = self._appended
+            while position < len(self.events):
+                kind, payload = self.events[position]
+                position += 1
+                yield kind, payload
+                if kind == "done":
+                    return
+            await appended.wait()
+
+
+class JobManager:
+    """Queue of jobs drained by a fixed pool of worker tasks, or by a QueueRunner."""
+
+    def __init__(self, pipeline, workers: int | None = None, runner=None):
+        self.pipeline = pipeline
+        self.workers = max(1, workers or JOB_WORKERS)
+        self.runner = runner
+        self.jobs = {}
+        self._queue = None
+        self._tasks = []
+        if runner is not None:
+            runner.on_done = self._on_done
+            runner.on_failed = self._on_failed
+
+    def start(self):
+        if self.runner is not None:
+            self._restore()
+            self.runner.start()
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.stop()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, shipments: list[dict]) -> Job:
+        self._prune()
+        job = Job(shipments)
+        self.jobs[job.id] = job
+        if self.runner is not None:
+            job.status = "running"
+            job.started = time.time()
+            job.shipments = None
+            self.runner.submit(job.id, shipments)
+            job.finish_if_complete()
+        else:
+            self._queue.put_nowait(job)
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        return self.jobs.get(job_id)
+
+    def _prune(self):
+        now = time.time()
+        finished = sorted((j for j in self.jobs.values() if j.is_finished), key=lambda j: j.finished)
+        expired = [j for j in finished if now - j.finished > JOB_TTL]
+        expired += finished[len(expired):max(len(expired), len(finished) - JOB_RETENTION)]
+        for job in expired:
+            del self.jobs[job.id]
+            if self.runner is not None:
+                self.runner.queue.delete_job(job.id)
+
+    def _on_done(self, job_id: str, index: int, record: dict):
+        job = self.jobs.get(job_id)
+        if job is not None:
+            job.add_result(index, record)
+            job.finish_if_complete()
+
+    def _on_failed(self, job_id: str, error: dict):
+        job = self.jobs.get(job_id)
+        if job is not None:
+            job.add_error(error)
+            job.finish_if_complete()
+
+    def _restore(self):
+        """Rebuild the jobs found in the work queue, e.g. after a restart."""
+        for job_id in self.runner.queue.job_ids():
+            rows = self.runner.queue.job_rows(job_id)
+            job = Job([], job_id)
+            job.total = len(rows)
+            job.status = "running"
+            job.started = time.time()
+            for row in rows:
+                if row["status"] == "done":
+                    job.add_result(row["index"], row["record"])
+                elif row["status"] == "failed":
+                    job.add_error({
+                        "index": row["index"],
+                        "shipment_id": row["record"].get("shipment_id"),
+                        "stage": row["stage"],
+                        "detail": row["error"],
+                    })
+            job.finish_if_complete()
+            self.jobs[job_id] = job
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            job.status = "running"
+            job.started = time.time()
+            try:
+                with tracing.span("job", parent=job.trace, job_id=job.id, shipments=job.total):
+                    await self.pipeline.run(job.shipments, on_result=job.add_result, on_error=job.add_error)
+                job.finish("done")
+            except Exception as e:
+                print(f"Job {job.id} failed: {e}")
+                job.finish("failed", f"{type(e).__name__}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        stats = {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "running": sum(1 for j in self.jobs.values() if j.status == "running"),
+            "kept": len(self.jobs),
+        }
+        if self.runner is not None:
+            stats["work_queue"] = self.runner.stats()
+        return stats
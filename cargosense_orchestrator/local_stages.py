@@ -0,0 +1,102 @@
+"""In-process ("monolith") execution of agent stages.
+
+Imports each agent's main.py straight from the agents/ folder and calls its
+batch function directly, skipping HTTP and JSON for single-box deployments.
+The orchestrator needs the requirements of every agent it runs locally.
+"""
+import asyncio
+import importlib.util
+import inspect
+import os
+import sys
+from pathlib import Path
+
+import tracing
+
+AGENTS_DIR = Path(os.getenv("CARGOSENSE_AGENTS_DIR", Path(__file__).resolve().parent.parent / "agents"))
+
+# stage -> (agent folder, batch function); the functions take plain dicts and validate per record
+STAGE_FUNCTIONS = {
+    "ingestion": ("1_ingestion", "ingest_batch"),
+    "geocode": ("2_geocode_route", "enrich_batch"),
+    "weather": ("3_weather", "enrich_weather_batch"),
+    "traffic": ("4_traffic", "enrich_congestion_batch"),
+    "features": ("5_feature_builder", "build_features_batch"),
+    "risk": ("6_riskmodel_randomForest", "add_risk_batch"),
+    "explain": ("7_explanation", "explain_batch"),
+    "notify": ("8_notify", "notify_batch"),
+}
+
+# Pure CPU stages run on the event loop; the rest go to a worker thread
+INLINE_STAGES = {"ingestion", "features", "notify"}
+
+# Imported once and shared with the agents, so their spans join the orchestrator's traces
+# and their upstream, cache and single-flight metrics show up on the orchestrator's /metrics
+SHARED_MODULES = {"tracing", "metrics"}
+
+_modules = {}
+
+
+def _import_agent(stage: str):
+    """Import agents/<dir>/main.py under a unique name.
+
+    Agents ship same-named helper modules (http_client, batching, ...), so
+    those are imported fresh for each agent and then removed from
+    sys.modules again, leaving the orchestrator's own copies untouched.
+    SHARED_MODULES are the exception: the agent uses the orchestrator's.
+    """
+    agent_dir = AGENTS_DIR / STAGE_FUNCTIONS[stage][0]
+    siblings = {path.stem for path in agent_dir.glob("*.py")} - SHARED_MODULES
+    saved = {name: sys.modules.pop(name) for name in siblings if name in sys.modules}
+    name = f"cargosense_agent_{stage}"
+    sys.path.insert(0, str(agent_dir))
+    try:
+        spec = importlib.util.spec_from_file_location(name, agent_dir / "main.py")
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(str(agent_dir))
+        for sibling in siblings:
+            sys.modules.pop(sibling, None)
+        sys.modules.update(saved)
+    return module
+
+
+def load(stage: str):
+    if stage not in _modules:
+        _modules[stage] = _import_agent(stage)
+    return _modules[stage]
+
+
+async def _run_handlers(handlers):
+    for handler in handlers:
+        result = handler()
+        if inspect.isawaitable(result):
+            await result
+
+
+async def startup(stages: list[str]):
+    """Import the local agents up front and run their startup hooks."""
+    for stage in stages:
+        await _run_handlers(load(stage).app.router.on_startup)
+
+
+async def shutdown():
+    for module in _modules.values():
+        await _run_handlers(module.app.router.on_shutdown)
+
+
+async def run(stage: str, records: list[dict]) -> list[dict]:
+    module = load(stage)
+    fn = getattr(module, STAGE_FUNCTIONS[stage][1])
+
+    # The agent's spans carry its own service name, as they would over HTTP
+    with tracing.as_service(getattr(module.app.state, "trace_service", stage)):
+        if inspect.iscoroutinefunction(fn):
+            results = await fn(records)
+        elif stage in INLINE_STAGES:
+            results = fn(records)
+        else:
+            results = await asyncio.to_thread(fn, records)
+    return results["processed"] if stage == "ingestion" else results
@@ -1,8 +1,21 @@
-import requests
+import os
+
 from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import StreamingResponse
+
+import http_client
+import jsonio
+import local_stages
+import metrics
+import tracing
+from jobs import JobManager
+from pipeline import Pipeline, StageError
+from work_queue import QueueRunner, WorkQueue
 
 
 app = FastAPI(title="CargoSense")
+metrics.instrument(app)
+tracing.instrument(app, "orchestrator")
 
 BASES = {
     "ingestion": "https://maestro-0bec3790-eb0d-45ca-919b-d3ba8e39987a-zcaxlbuauq-uc.a.run.app/ingest",
@@ -16,9 +29,62 @@ BASES = {
     "notify": "https://maestro-8881cf6e-c07b-4bce-98a3-34318e42cdfd-zcaxlbuauq-uc.a.run.app/notify",
 }
 
-def call(agent, payload):
-    resp = requests.post(BASES[agent], json=payload)
-    return resp.json()
+STAGES = ["ingestion", "geocode", "weather", "traffic", "features", "risk", "explain", "notify"]
+
+# Point a stage at another deployment with STAGE_URL_<STAGE>
+for _stage in STAGES:
+    BASES[_stage] = os.getenv(f"STAGE_URL_{_stage.upper()}", BASES[_stage])
+
+# Every agent exposes a batch variant of its endpoint at "<path>_batch"
+BATCH_BASES = {agent: url + "_batch" for agent, url in BASES.items()}
+
+# "remote" calls the agents over HTTP, "local" imports and calls them in-process.
+# STAGE_MODE sets the default, STAGE_MODE_<STAGE> overrides one stage.
+DEFAULT_MODE = os.getenv("STAGE_MODE", "remote")
+STAGE_MODES = {s: os.getenv(f"STAGE_MODE_{s.upper()}", DEFAULT_MODE) for s in STAGES}
+LOCAL_STAGES = [s for s in STAGES if STAGE_MODES[s] == "local"]
+
+# Fields each agent reads (None = the whole record). With SLIM_PAYLOADS on, remote stages get
+# only these and send back only the fields they add or change, which run_stage merges back in.
+STAGE_INPUTS = {
+    "ingestion": None,
+    "geocode": None,
+    "weather": ["shipment_id", "route_polyline", "origin_lat", "origin_lon", "dest_lat", "dest_lon"],
+    "traffic": ["shipment_id", "route_polyline"],
+    "features": [
+        "shipment_id", "dispatch_ts", "expected_ts", "carrier",
+        "distance_km", "origin_rain_mm", "origin_storm", "congestion_index",
+    ],
+    "risk": ["shipment_id", "features"],
+    "explain": ["shipment_id", "risk_level", "delay_prob", "features"],
+    "notify": ["shipment_id", "risk_level"],
+}
+SLIM_PAYLOADS = os.getenv("SLIM_PAYLOADS", "1") == "1"
+
+# Fields no later stage reads, dropped from the record once the stage has run so they stay out
+# of responses, job results and the work queue. KEEP_ROUTE_POLYLINE=1 keeps the whole route.
+DROP_AFTER = {"traffic": [] if os.getenv("KEEP_ROUTE_POLYLINE", "0") == "1" else ["route_polyline"]}
+
+def slim(stage, record):
+    fields = STAGE_INPUTS.get(stage)
+    if fields is None:
+        return record
+    return {field: record[field] for field in fields if field in record}
+
+async def call(agent, payload):
+    headers = {"Content-Type": "application/json"}
+    if SLIM_PAYLOADS:
+        headers[jsonio.DELTA_HEADER] = "1"
+        payload = [slim(agent, record) for record in payload]
+    # Retry only when the batch cannot have reached the agent (or it is unavailable); a slow
+    # or failed batch is not sent again, which would repeat all its work (and Gemini calls)
+    resp = await http_client.apost(
+        BATCH_BASES[agent], content=jsonio.dumps(payload), headers=headers, timeout=120,
+        retry_on=http_client.CONNECT_ERRORS, retry_statuses={503},
+    )
+    resp.raise_for_status()
+    results = jsonio.loads(resp.content)
+    return results["processed"] if agent == "ingestion" else results
 
 
 # Required shipment fields
@@ -41,39 +107,136 @@ def validate_shipments(shipments: list):
                 detail=f"Shipment {i} missing field(s): {', '.join(missing)}"
             )
 
-def run_pipeline(data):
-    shipment_records = []
-    processed_records = []
+STAGE_LATENCY = metrics.histogram(
+    "stage_duration_seconds", "Time for one batch call to a pipeline stage", ("stage", "mode")
+)
+STAGE_IN_FLIGHT = metrics.gauge("stage_batches_in_flight", "Batch calls a stage is working on", ("stage",))
+STAGE_ERRORS = metrics.counter("stage_errors_total", "Shipments that failed at a stage", ("stage",))
+STAGE_SHIPMENTS = metrics.counter("stage_shipments_total", "Shipments sent to a stage", ("stage",))
+
+async def run_stage(stage, records):
+    """Send a batch of shipments to one agent and check its results."""
+    mode = "local" if stage in LOCAL_STAGES else "remote"
+    STAGE_SHIPMENTS.inc(len(records), stage=stage)
+    # One span per batch call; the agent's own spans (and its upstream calls) hang below it
+    with tracing.span(f"stage {stage}", stage=stage, mode=mode,
+                      shipment_ids=[r.get("shipment_id") for r in records]) as span:
+        try:
+            with STAGE_IN_FLIGHT.track(stage=stage), STAGE_LATENCY.time(stage=stage, mode=mode):
+                if mode == "local":
+                    results = await local_stages.run(stage, records)
+                else:
+                    results = await call(stage, records)
+        except Exception:
+            STAGE_ERRORS.inc(len(records), stage=stage)
+            raise
+        span.set("errors", sum("stage_error" in r for r in results))
+
+    checked = []
+    for record, result in zip(records, results):
+        if "stage_error" in result:
+            checked.append(StageError(stage, result["stage_error"]))
+        elif stage == "geocode" and not result.get("geocode_ok", True):
+            checked.append(StageError(stage, result.get("error", "geocoding failed")))
+        else:
+            # Remote stages may answer with just the fields they added
+            merged = result if result is record else {**record, **result}
+            for field in DROP_AFTER.get(stage, []):
+                merged.pop(field, None)
+            checked.append(merged)
+    STAGE_ERRORS.inc(sum(isinstance(c, StageError) for c in checked), stage=stage)
+    return checked
+
+pipeline = Pipeline(STAGES, run_stage)
+# JOB_BACKEND=queue runs jobs through the durable SQLite work queue (per-stage workers,
+# retries, backpressure, survives restarts) instead of in memory
+if os.getenv("JOB_BACKEND", "memory") == "queue":
+    jobs = JobManager(pipeline, runner=QueueRunner(WorkQueue(), STAGES, run_stage))
+else:
+    jobs = JobManager(pipeline)
+
+# Attach a per-shipment "timings" breakdown to /cargosense results (or ask with ?timings=true)
+ATTACH_TIMINGS = os.getenv("ATTACH_TIMINGS", "0") == "1"
 
-    for entry in data:
-        record = call("ingestion",entry)
-        shipment_records.append(record["processed"])
+async def run_pipeline(data, timings=False):
+    return await pipeline.run(data, timings=timings)
 
-    for ship in shipment_records:
-        s = call("geocode", ship)
-        w = call("weather", s)
-        t = call("traffic", w)
-        fts = call("features", t)
-        r = call("risk", fts)
-        e = call("explain", r)
-        n = call("notify", e)
-        processed_records.append(n)
-    return processed_records
+
+@app.on_event("startup")
+async def start_local_stages():
+    await local_stages.startup(LOCAL_STAGES)
+    jobs.start()
+
+
+@app.on_event("shutdown")
+async def close_http_pool():
+    await jobs.stop()
+    await local_stages.shutdown()
+    await http_client.aclose()
 
 
 @app.get("/health")
 def health():
-    return {"status": "CargoSense alive"}
+    return {"status": "CargoSense alive", "jobs": jobs.stats()}
 
-@app.post("/cargosense")
-async def notify_endpoint(request: Request):
-    shipment = await request.json()
+async def read_shipments(request: Request) -> list:
+    shipment = await jsonio.read_json(request)
     # Ensure it's a list
     if not isinstance(shipment, list):
         raise HTTPException(status_code=400, detail="Input must be a list of shipments")
 
     # validate before running pipeline
     validate_shipments(shipment)
+    return shipment
+
+@app.post("/cargosense")
+async def notify_endpoint(request: Request, timings: bool = ATTACH_TIMINGS):
+    shipment = await read_shipments(request)
+    output, errors = await run_pipeline(shipment, timings)
+    return jsonio.response({"processed_shipments": output, "errors": errors})
+
+# -------- Jobs: submit now, poll or stream results as shipments finish --------
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: Request):
+    job = jobs.submit(await read_shipments(request))
+    return {
+        **job.summary(),
+        "status_url": f"/jobs/{job.id}",
+        "stream_url": f"/jobs/{job.id}/stream",
+        "results_url": f"/jobs/{job.id}/results",
+    }
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    return get_job(job_id).summary()
+
+@app.get("/jobs/{job_id}/results")
+def job_results(job_id: str):
+    """Everything finished so far, in input order (complete once status is "done")."""
+    job = get_job(job_id)
+    return jsonio.response({**job.summary(), **job.results()})
+
+@app.get("/jobs/{job_id}/stream")
+async def job_stream(job_id: str, request: Request, format: str | None = None):
+    """One event per shipment as it leaves the notify stage (or fails), then a final "done".
+
+    NDJSON by default; Server-Sent Events with ?format=sse or Accept: text/event-stream.
+    """
+    job = get_job(job_id)
+    sse = format == "sse" or (format is None and "text/event-stream" in request.headers.get("accept", ""))
+
+    async def events():
+        async for kind, payload in job.stream():
+            if sse:
+                yield f"event: {kind}\ndata: ".encode() + jsonio.dumps(payload) + b"\n\n"
+            else:
+                yield jsonio.dumps({"type": kind, **payload}) + b"\n"
 
-    output = run_pipeline(shipment)
-    return {"processed_shipments": output}
\ No newline at end of file
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type, headers={"Cache-Control": "no-cache"})
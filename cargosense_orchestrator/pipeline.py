@@ -0,0 +1,112 @@
+import asyncio
+import os
+import time
+
+# Default number of in-flight calls per stage; override per stage with
+# STAGE_CONCURRENCY_<STAGE> (e.g. STAGE_CONCURRENCY_WEATHER=32)
+DEFAULT_CONCURRENCY = int(os.getenv("STAGE_CONCURRENCY", "16"))
+
+# Shipments sent to an agent per batch call
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "25"))
+
+
+def stage_limit(stage: str) -> int:
+    value = os.getenv(f"STAGE_CONCURRENCY_{stage.upper()}")
+    return max(1, int(value)) if value else DEFAULT_CONCURRENCY
+
+
+class StageError(Exception):
+    """Marks a shipment that cannot continue down the chain."""
+
+    def __init__(self, stage: str, detail: str):
+        super().__init__(f"{stage}: {detail}")
+        self.stage = stage
+        self.detail = detail
+
+
+class Pipeline:
+    """Runs shipments concurrently, in batches, through an ordered list of stages.
+
+    `run_stage(stage, records)` is a coroutine that takes a batch of records
+    and returns one entry per record, in order: the next record, or a
+    `StageError` for a shipment that failed. If the whole call raises, every
+    shipment in that batch fails at that stage.
+
+    Each stage has its own limit on in-flight batch calls, so a slow stage only
+    queues its own callers. Failed shipments are reported in `errors` and never
+    abort the rest of the run; successful results keep the input order.
+
+    `on_result(index, record)` and `on_error(error)` are called as soon as a
+    shipment leaves the chain, for callers that stream progress. With
+    `timings`, each result carries "timings": seconds spent in every stage's
+    batch call (including the wait for a free slot) and the total.
+    """
+
+    def __init__(self, stages: list[str], run_stage, limits: dict | None = None,
+                 batch_size: int | None = None):
+        self.stages = stages
+        self.run_stage = run_stage
+        self.limits = {s: (limits or {}).get(s) or stage_limit(s) for s in stages}
+        self.batch_size = max(1, batch_size or BATCH_SIZE)
+
+    async def _call(self, stage: str, records: list[dict], semaphores: dict) -> list:
+        async with semaphores[stage]:
+            try:
+                results = await self.run_stage(stage, records)
+            except Exception as e:
+                return [e] * len(records)
+        if len(results) != len(records):
+            error = StageError(stage, f"expected {len(records)} results, got {len(results)}")
+            return [error] * len(records)
+        return results
+
+    async def _run_chunk(self, chunk: list[tuple[int, dict]], semaphores: dict,
+                         on_result=None, on_error=None, timings: bool = False):
+        done, errors = [], []
+        live = [(index, entry, entry) for index, entry in chunk]
+        started = time.perf_counter()
+        stage_times = {}
+        for stage in self.stages:
+            if not live:
+                break
+            start = time.perf_counter()
+            results = await self._call(stage, [record for _, _, record in live], semaphores)
+            stage_times[stage] = round(time.perf_counter() - start, 4)
+            survivors = []
+            for (index, entry, _), result in zip(live, results):
+                if isinstance(result, Exception):
+                    error = {
+                        "index": index,
+                        "shipment_id": entry.get("shipment_id"),
+                        "stage": getattr(result, "stage", stage),
+                        "detail": getattr(result, "detail", None) or str(result),
+                    }
+                    errors.append(error)
+                    if on_error:
+                        on_error(error)
+                else:
+                    survivors.append((index, entry, result))
+            live = survivors
+        done.extend((index, record) for index, _, record in live)
+        if timings:
+            # Every shipment of the chunk shared each batch call
+            total = round(time.perf_counter() - started, 4)
+            for _, record in done:
+                record["timings"] = {**stage_times, "total": total}
+        if on_result:
+            for index, record in done:
+                on_result(index, record)
+        return done, errors
+
+    async def run(self, data: list[dict], on_result=None, on_error=None,
+                  timings: bool = False) -> tuple[list[dict], list[dict]]:
+        semaphores = {s: asyncio.Semaphore(n) for s, n in self.limits.items()}
+        indexed = list(enumerate(data))
+        chunks = [indexed[i:i + self.batch_size] for i in range(0, len(indexed), self.batch_size)]
+        outcomes = await asyncio.gather(*(
+            self._run_chunk(c, semaphores, on_result, on_error, timings) for c in chunks
+        ))
+
+        done = sorted((item for d, _ in outcomes for item in d), key=lambda item: item[0])
+        errors = sorted((e for _, errs in outcomes for e in errs), key=lambda e: e["index"])
+        return [record for _, record in done], errors
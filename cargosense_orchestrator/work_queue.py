@@ -0,0 +1,268 @@
+"""Durable, SQLite-backed work queue between pipeline stages.
+
+Every shipment of a job is one row that records the stage it has to run
+next and its record as of the last finished stage. Each stage has its own
+pool of workers that lease a batch of ready rows, call the stage and then
+settle the rows: advanced to the next stage, retried later with backoff, or
+failed. Leases expire, so rows held by a worker that died become ready
+again; on start every lease is released, so after a restart or redeploy the
+job carries on where it stopped. Use one orchestrator process per queue file.
+
+A stage stops leasing while the queue in front of the next stage is longer
+than QUEUE_MAX_DEPTH, so a slow stage (weather, Gemini) holds back the cheap
+stages before it instead of piling work up in memory.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import httpx
+
+import http_client
+from pipeline import BATCH_SIZE, StageError
+
+QUEUE_PATH = os.getenv("QUEUE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "work_queue.db"))
+# Workers per stage; override per stage with QUEUE_WORKERS_<STAGE> (e.g. QUEUE_WORKERS_EXPLAIN=8)
+DEFAULT_WORKERS = int(os.getenv("QUEUE_WORKERS", "2"))
+QUEUE_MAX_DEPTH = int(os.getenv("QUEUE_MAX_DEPTH", "500"))
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "3"))
+QUEUE_BACKOFF = float(os.getenv("QUEUE_BACKOFF", "2"))
+QUEUE_LEASE = float(os.getenv("QUEUE_LEASE", "300"))
+QUEUE_POLL = float(os.getenv("QUEUE_POLL", "0.5"))
+
+DONE = "done"
+
+
+def stage_workers(stage: str) -> int:
+    value = os.getenv(f"QUEUE_WORKERS_{stage.upper()}")
+    return max(1, int(value)) if value else DEFAULT_WORKERS
+
+
+class WorkQueue:
+    def __init__(self, path: str = QUEUE_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS work ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL, idx INTEGER NOT NULL, "
+                "stage TEXT NOT NULL, status TEXT NOT NULL, payload TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL, error TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS work_stage ON work (stage, status, available_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS work_job ON work (job_id, idx)")
+
+    def put(self, job_id: str, records: list[dict], stage: str):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO work (job_id, idx, stage, status, payload, available_at) VALUES (?, ?, ?, 'ready', ?, ?)",
+                [(job_id, i, stage, json.dumps(r), now) for i, r in enumerate(records)],
+            )
+
+    def lease(self, stage: str, n: int, lease: float = QUEUE_LEASE) -> list[dict]:
+        """Up to n ready rows of `stage` (or rows whose lease ran out), held for `lease` seconds."""
+        now = time.time()
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT id, job_id, idx, payload, attempts FROM work "
+                "WHERE stage = ? AND status IN ('ready', 'leased') AND available_at <= ? ORDER BY id LIMIT ?",
+                (stage, now, n),
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE work SET status = 'leased', available_at = ? WHERE id = ?",
+                [(now + lease, row[0]) for row in rows],
+            )
+        return [
+            {"id": id_, "job_id": job_id, "index": idx, "record": json.loads(payload), "attempts": attempts}
+            for id_, job_id, idx, payload, attempts in rows
+        ]
+
+    def settle(self, advanced: list, next_stage: str | None, retried: list, failed: list):
+        """advanced: [(id, record)], retried: [(id, delay, error)], failed: [(id, error)]."""
+        now = time.time()
+        stage, status = (next_stage, "ready") if next_stage else (DONE, DONE)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE work SET stage = ?, status = ?, payload = ?, attempts = 0, available_at = ?, error = NULL "
+                "WHERE id = ?",
+                [(stage, status, json.dumps(record), now, id_) for id_, record in advanced],
+            )
+            self._conn.executemany(
+                "UPDATE work SET status = 'ready', attempts = attempts + 1, available_at = ?, error = ? WHERE id = ?",
+                [(now + delay, error, id_) for id_, delay, error in retried],
+            )
+            self._conn.executemany(
+                "UPDATE work SET status = 'failed', error = ? WHERE id = ?",
+                [(error, id_) for id_, error in failed],
+            )
+
+    def release_leases(self):
+        """Make every leased row ready again (its worker is gone)."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE work SET status = 'ready', available_at = ? WHERE status = 'leased'", (time.time(),))
+
+    def depth(self, stage: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM work WHERE stage = ? AND status IN ('ready', 'leased')", (stage,)
+            ).fetchone()[0]
+
+    def job_ids(self) -> list[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT DISTINCT job_id FROM work ORDER BY id")]
+
+    def job_rows(self, job_id: str) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT idx, stage, status, payload, error FROM work WHERE job_id = ? ORDER BY idx", (job_id,)
+            ).fetchall()
+        return [
+            {"index": idx, "stage": stage, "status": status, "record": json.loads(payload), "error": error}
+            for idx, stage, status, payload, error in rows
+        ]
+
+    def delete_job(self, job_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM work WHERE job_id = ?", (job_id,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT stage, status, COUNT(*) FROM work GROUP BY stage, status").fetchall()
+        stats = {}
+        for stage, status, count in rows:
+            stats.setdefault(stage, {})[status] = count
+        return stats
+
+
+def retryable(error: Exception) -> bool:
+    """Same set as the orchestrator's stage calls: the agent did not get to run the batch."""
+    if isinstance(error, http_client.CONNECT_ERRORS):
+        return True
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 503
+
+
+class QueueRunner:
+    """Per-stage worker pools that move rows of a WorkQueue through the stages.
+
+    `run_stage(stage, records)` is the same coroutine the in-memory Pipeline
+    uses. Errors where the batch cannot have reached the agent (connect
+    errors, 503) are retried with exponential backoff, QUEUE_MAX_ATTEMPTS
+    attempts in all; anything else fails the shipments, since the agent may
+    already have done the work. `on_done(job_id,
+    index, record)` and `on_failed(job_id, error)` fire as shipments leave
+    the chain.
+    """
+
+    def __init__(self, queue: WorkQueue, stages: list[str], run_stage, on_done=None, on_failed=None,
+                 workers: dict | None = None, batch_size: int | None = None):
+        self.queue = queue
+        self.stages = stages
+        self.run_stage = run_stage
+        self.on_done = on_done
+        self.on_failed = on_failed
+        self.workers = {s: (workers or {}).get(s) or stage_workers(s) for s in stages}
+        self.batch_size = max(1, batch_size or BATCH_SIZE)
+        self.throttled = {s: 0 for s in stages}
+        self._wake = {}
+        self._tasks = []
+
+    def start(self):
+        # One orchestrator process owns the queue file, so leases left from a previous run are stale
+        self.queue.release_leases()
+        self._wake = {s: asyncio.Event() for s in self.stages}
+        self._tasks = [
+            asyncio.create_task(self._work(stage))
+            for stage in self.stages
+            for _ in range(self.workers[stage])
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, job_id: str, records: list[dict]):
+        self.queue.put(job_id, records, self.stages[0])
+        self._wake[self.stages[0]].set()
+
+    async def _idle(self, stage: str):
+        try:
+            await asyncio.wait_for(self._wake[stage].wait(), QUEUE_POLL)
+        except asyncio.TimeoutError:
+            pass
+        self._wake[stage].clear()
+
+    async def _work(self, stage: str):
+        position = self.stages.index(stage)
+        next_stage = self.stages[position + 1] if position + 1 < len(self.stages) else None
+        while True:
+            try:
+                # Backpressure: leave work here while the next stage is behind
+                if next_stage and await asyncio.to_thread(self.queue.depth, next_stage) >= QUEUE_MAX_DEPTH:
+                    self.throttled[stage] += 1
+                    await asyncio.sleep(QUEUE_POLL)
+                    continue
+                items = await asyncio.to_thread(self.queue.lease, stage, self.batch_size)
+                if not items:
+                    await self._idle(stage)
+                    continue
+                await self._run(stage, next_stage, items)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Queue worker for {stage} failed: {e}")
+                await asyncio.sleep(QUEUE_POLL)
+
+    async def _run(self, stage: str, next_stage: str | None, items: list[dict]):
+        try:
+            results = await self.run_stage(stage, [item["record"] for item in items])
+            if len(results) != len(items):
+                raise StageError(stage, f"expected {len(items)} results, got {len(results)}")
+        except Exception as e:
+            results = [e] * len(items)
+
+        advanced, retried, failed = [], [], []
+        for item, result in zip(items, results):
+            if not isinstance(result, Exception):
+                advanced.append((item, result))
+                continue
+            detail = getattr(result, "detail", None) or f"{type(result).__name__}: {result}"
+            if not retryable(result) or item["attempts"] + 1 >= QUEUE_MAX_ATTEMPTS:
+                failed.append((item, getattr(result, "stage", stage), detail))
+            else:
+                retried.append((item["id"], QUEUE_BACKOFF * 2 ** item["attempts"], detail))
+
+        await asyncio.to_thread(
+            self.queue.settle,
+            [(item["id"], record) for item, record in advanced],
+            next_stage,
+            retried,
+            [(item["id"], detail) for item, _, detail in failed],
+        )
+        if next_stage and advanced:
+            self._wake[next_stage].set()
+
+        if not next_stage and self.on_done:
+            for item, record in advanced:
+                self.on_done(item["job_id"], item["index"], record)
+        if self.on_failed:
+            for item, failed_stage, detail in failed:
+                self.on_failed(item["job_id"], {
+                    "index": item["index"],
+                    "shipment_id": item["record"].get("shipment_id"),
+                    "stage": failed_stage,
+                    "detail": detail,
+                })
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "throttled": self.throttled,
+            "queue": self.queue.stats(),
+        }
@@ -1,46 +1,132 @@
-import random
+"""Synthetic shipment data for training the delay model.
+
+Rows are generated with NumPy a chunk at a time, so tens of millions of
+them fit in a fixed amount of memory, and written as CSV (small samples),
+one `.npy` file per column (memory-mapped when training) or Parquet (needs
+pyarrow):
+
+    python data.py                                               # 1000 rows -> synthetic_shipments.csv
+    python data.py --rows 50000000 --format npy --out shipments_npy
+    python data.py --rows 50000000 --format parquet --out shipments.parquet
+
+The columnar formats leave out shipment_id; row i is SHP-{1001 + i}.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
 import pandas as pd
 
+FEATURES = [
+    "distance_km",
+    "hours_to_deadline",
+    "origin_rain_mm",
+    "origin_storm",
+    "congestion_index",
+    "carrier_reliability",
+]
+TARGET = "delay_prob"
+COLUMNS = FEATURES + [TARGET]
+DTYPES = {name: np.int8 if name == "origin_storm" else np.float32 for name in COLUMNS}
+CHUNK_ROWS = 1_000_000
+
+
+def generate_chunk(n: int, rng: np.random.Generator) -> dict:
+    """n rows as {column: array}."""
+    distance_km = np.round(rng.uniform(50, 2000, n), 2)
+    hours_to_deadline = np.round(rng.uniform(2, 72, n), 1)
+    origin_rain_mm = np.round(rng.uniform(0, 50, n), 1)
+    # A storm is a coin flip, and only possible in heavy rain
+    origin_storm = ((origin_rain_mm > 20) & (rng.integers(0, 2, n) == 1)).astype(np.int8)
+    congestion_index = np.round(rng.uniform(0, 1, n), 2)
+    carrier_reliability = np.round(rng.uniform(0.5, 0.99, n), 2)
+
+    # Synthetic delay probability formula
+    delay_prob = (
+        0.3 * (distance_km / 2000) +
+        0.2 * (1 - carrier_reliability) +
+        0.2 * congestion_index +
+        0.2 * (origin_rain_mm / 50) +
+        0.1 * origin_storm
+    )
+    delay_prob = np.round(np.minimum(1, delay_prob), 3)  # clamp between 0 and 1
+
+    columns = {
+        "distance_km": distance_km,
+        "hours_to_deadline": hours_to_deadline,
+        "origin_rain_mm": origin_rain_mm,
+        "origin_storm": origin_storm,
+        "congestion_index": congestion_index,
+        "carrier_reliability": carrier_reliability,
+        "delay_prob": delay_prob,
+    }
+    return {name: values.astype(DTYPES[name]) for name, values in columns.items()}
+
+
+def generate_chunks(n: int, seed: int = 42, chunk_rows: int = CHUNK_ROWS):
+    """Yield (first row, columns) for n rows, chunk_rows at a time."""
+    rng = np.random.default_rng(seed)
+    for start in range(0, n, chunk_rows):
+        yield start, generate_chunk(min(chunk_rows, n - start), rng)
+
+
 def generate_shipment_data(n=1000, seed=42):
-    random.seed(seed)
-    records = []
-
-    for i in range(1, n + 1):
-        shipment_id = f"SHP-{1000+i}"
-
-        # Features
-        distance_km = round(random.uniform(50, 2000), 2)
-        hours_to_deadline = round(random.uniform(2, 72), 1)
-        origin_rain_mm = round(random.uniform(0, 50), 1)
-        origin_storm = random.choice([0, 1]) if origin_rain_mm > 20 else 0
-        congestion_index = round(random.uniform(0, 1), 2)
-        carrier_reliability = round(random.uniform(0.5, 0.99), 2)
-
-        # Synthetic delay probability formula
-        delay_prob = (
-            0.3 * (distance_km / 2000) +
-            0.2 * (1 - carrier_reliability) +
-            0.2 * congestion_index +
-            0.2 * (origin_rain_mm / 50) +
-            0.1 * origin_storm
-        )
-        delay_prob = round(min(1, delay_prob), 3)  # clamp between 0 and 1
-
-        records.append({
-            "shipment_id": shipment_id,
-            "distance_km": distance_km,
-            "hours_to_deadline": hours_to_deadline,
-            "origin_rain_mm": origin_rain_mm,
-            "origin_storm": origin_storm,
-            "congestion_index": congestion_index,
-            "carrier_reliability": carrier_reliability,
-            "delay_prob": delay_prob
-        })
-
-    return pd.DataFrame(records)
+    frames = [pd.DataFrame(columns) for _, columns in generate_chunks(n, seed)]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=COLUMNS)
+    df.insert(0, "shipment_id", [f"SHP-{1001 + i}" for i in range(len(df))])
+    return df
+
+
+def write_npy(path: str, n: int, seed: int, chunk_rows: int):
+    """One .npy file per column in directory `path`, filled chunk by chunk."""
+    os.makedirs(path, exist_ok=True)
+    files = {
+        name: np.lib.format.open_memmap(os.path.join(path, f"{name}.npy"), mode="w+", dtype=DTYPES[name], shape=(n,))
+        for name in COLUMNS
+    }
+    for start, columns in generate_chunks(n, seed, chunk_rows):
+        for name, values in columns.items():
+            files[name][start:start + len(values)] = values
+    for column in files.values():
+        column.flush()
+
+
+def write_parquet(path: str, n: int, seed: int, chunk_rows: int):
+    """One Parquet row group per chunk."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Parquet output needs pyarrow (pip install pyarrow), or use --format npy")
+
+    schema = pa.schema([(name, pa.from_numpy_dtype(DTYPES[name])) for name in COLUMNS])
+    with pq.ParquetWriter(path, schema) as writer:
+        for _, columns in generate_chunks(n, seed, chunk_rows):
+            writer.write_table(pa.table(columns, schema=schema))
+
+
+def write_csv(path: str, n: int, seed: int, chunk_rows: int):
+    header = True
+    for start, columns in generate_chunks(n, seed, chunk_rows):
+        df = pd.DataFrame(columns)
+        df.insert(0, "shipment_id", [f"SHP-{1001 + i}" for i in range(start, start + len(df))])
+        df.to_csv(path, mode="w" if header else "a", header=header, index=False)
+        header = False
+
+
+WRITERS = {"csv": write_csv, "npy": write_npy, "parquet": write_parquet}
 
 
 if __name__ == "__main__":
-    df = generate_shipment_data(1000)
-    df.to_csv("hackathon/cargo/model/synthetic_shipments.csv", index=False)
-    print("Synthetic dataset saved as synthetic_shipments.csv")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--format", choices=sorted(WRITERS), default="csv")
+    parser.add_argument("--out", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "synthetic_shipments.csv"))
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    WRITERS[args.format](args.out, args.rows, args.seed, args.chunk_rows)
+    print(f"Wrote {args.rows} rows to {args.out} in {time.perf_counter() - start:.1f}s")
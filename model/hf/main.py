@@ -1,16 +1,17 @@
 from fastapi import FastAPI, Request
-import pickle
 import numpy as np
 import os
 
+from forest import load_forest
+
 app = FastAPI(title="Shipment Delay Prediction API")
 
 # -------- Load ML model --------
-MODEL_PATH = "shipment_delay_model.pkl"
+# Compiled from shipment_delay_model.pkl with forest.py; memory-mapped, no scikit-learn needed
+MODEL_PATH = "shipment_delay_model.forest"
 model = None
 if os.path.exists(MODEL_PATH):
-    with open(MODEL_PATH, "rb") as f:
-        model = pickle.load(f)
+    model = load_forest(MODEL_PATH)
 
 
 # -------- ML predictor --------
@@ -29,6 +30,29 @@ def ml_score(features: dict) -> float:
     return float(model.predict(arr)[0])  # regression
 
 
+# -------- Vectorized batch predictor --------
+# Model input columns, in training order, with the defaults ml_score uses
+ML_FEATURES = [
+    ("distance_km", 0.0),
+    ("hours_to_deadline", 0.0),
+    ("origin_rain_mm", 0.0),
+    ("origin_storm", 0),
+    ("congestion_index", 0.0),
+    ("carrier_reliability", 0.7),
+]
+
+def ml_scores(features: list[dict]) -> np.ndarray:
+    """ml_score for N feature dicts with a single predict call."""
+    X = np.array([[f.get(name, default) for name, default in ML_FEATURES] for f in features], dtype=float)
+    if hasattr(model, "predict_proba"):  # classifier
+        return model.predict_proba(X)[:, 1]
+    return model.predict(X)  # regression
+
+
+def risk_level(delay_prob: float) -> str:
+    return "HIGH" if delay_prob >= 0.6 else "MEDIUM" if delay_prob >= 0.3 else "LOW"
+
+
 # -------- API endpoints --------
 @app.get("/health")
 def health():
@@ -37,7 +61,8 @@ def health():
 @app.post("/predict")
 async def predict_endpoint(request: Request):
     shipment = await request.json()
-    features = shipment.get("features", {})
+    # Shipments send "features"; the risk agent sends {"inputs": features}
+    features = shipment.get("features") or shipment.get("inputs") or {}
 
     if model is None:
         return {"error": "Model not loaded on server."}
@@ -45,5 +70,23 @@ async def predict_endpoint(request: Request):
     delay_prob = ml_score(features)
     return {
         "delay_prob": round(delay_prob, 3),
-        "risk_level": "HIGH" if delay_prob >= 0.6 else "MEDIUM" if delay_prob >= 0.3 else "LOW"
+        "risk_level": risk_level(delay_prob),
     }
+
+@app.post("/predict_batch")
+async def predict_batch_endpoint(request: Request):
+    """Takes {"inputs": [features, ...]}, returns one prediction per input, in order."""
+    body = await request.json()
+    features = body.get("inputs", []) if isinstance(body, dict) else body
+
+    if model is None:
+        return {"error": "Model not loaded on server."}
+    if not features:
+        return []
+
+    probs = ml_scores(features)
+    return [
+        {"delay_prob": round(float(p), 3), "risk_level": risk_level(float(p))}
+        for p in probs
+    ]
+
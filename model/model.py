@@ -1,33 +1,187 @@
+"""Train the shipment delay model.
+
+Reads a dataset written by data.py (CSV, a directory of .npy columns or
+Parquet), holds out the last rows for evaluation and fits a
+RandomForestClassifier on all cores. Writes the pickle and the `.forest`
+artifact the risk services load.
+
+    python model.py                                              # synthetic_shipments.csv
+    python model.py --data shipments_npy --n-jobs -1 --max-samples 0.05
+    python model.py --data shipments_npy --chunk-rows 5000000   # bounded memory
+
+With --chunk-rows the training rows are read chunk by chunk and every chunk
+adds its share of the trees (warm_start), so no more than one chunk is in
+memory at a time. Each chunk needs at least one tree, so with fewer trees than
+chunks the chunks are made larger until every row is used. Training time and peak memory are printed and, with
+--report, written as JSON.
+"""
+import argparse
+import json
+import math
+import os
+import pickle
+import resource
+import sys
+import time
+
+import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import classification_report
-import pickle
 
-# Load dataset
-df = pd.read_csv("hackathon/cargo/model/synthetic_shipments.csv")
+from data import FEATURES, TARGET
+from forest import export_forest
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# -------- Reading datasets --------
+def count_rows(path: str) -> int:
+    if os.path.isdir(path):
+        return len(np.load(os.path.join(path, f"{TARGET}.npy"), mmap_mode="r"))
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+    with open(path) as f:
+        return sum(1 for _ in f) - 1
+
+
+def iter_chunks(path: str, chunk_rows: int):
+    """Yield (first row, features as float32 (n, 6), delay_prob) for the whole dataset."""
+    if os.path.isdir(path):
+        columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in FEATURES + [TARGET]}
+        n = len(columns[TARGET])
+        for start in range(0, n, chunk_rows):
+            stop = min(start + chunk_rows, n)
+            X = np.column_stack([columns[name][start:stop] for name in FEATURES]).astype(np.float32)
+            yield start, X, np.asarray(columns[TARGET][start:stop])
+        return
+
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        batches = (b.to_pandas() for b in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=FEATURES + [TARGET]))
+    else:
+        batches = pd.read_csv(path, chunksize=chunk_rows, usecols=FEATURES + [TARGET])
+    start = 0
+    for df in batches:
+        yield start, df[FEATURES].to_numpy(np.float32), df[TARGET].to_numpy()
+        start += len(df)
+
+
+def read_rows(path: str, first: int, last: int, chunk_rows: int):
+    """Rows [first, last) as (X, y), read a chunk at a time."""
+    parts = []
+    for start, X, delay_prob in iter_chunks(path, chunk_rows):
+        lo, hi = max(first, start) - start, min(last, start + len(X)) - start
+        if lo < hi:
+            parts.append((X[lo:hi], delay_prob[lo:hi]))
+        if start + len(X) >= last:
+            break
+    if not parts:
+        return np.empty((0, len(FEATURES)), np.float32), np.empty(0, int)
+    return np.concatenate([X for X, _ in parts]), labels(np.concatenate([p for _, p in parts]))
+
+
+def labels(delay_prob: np.ndarray) -> np.ndarray:
+    # Binary target
+    return (delay_prob > 0.5).astype(np.int8)
+
+
+# -------- Training --------
+def peak_memory_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
 
-# Create binary target
-df["delayed"] = (df["delay_prob"] > 0.5).astype(int)
+def train(path: str, n_estimators=100, n_jobs=-1, max_samples=None, max_depth=None, min_samples_leaf=1,
+          test_size=0.2, max_test_rows=1_000_000, chunk_rows=None, seed=42):
+    n = count_rows(path)
+    n_test = min(int(n * test_size), max_test_rows)
+    n_train = n - n_test
+    clf = RandomForestClassifier(
+        n_estimators=n_estimators, n_jobs=n_jobs, max_samples=max_samples, max_depth=max_depth,
+        min_samples_leaf=min_samples_leaf, random_state=seed,
+    )
 
-# Features & target
-X = df.drop(columns=["shipment_id", "delay_prob", "delayed"])
-y = df["delayed"]
+    start = time.perf_counter()
+    if chunk_rows and chunk_rows < n_train:
+        # Every chunk grows at least one tree, so there can be no more chunks than trees
+        min_rows = math.ceil(n_train / n_estimators)
+        if chunk_rows < min_rows:
+            print(f"{n_train} rows in chunks of {chunk_rows} is more chunks than {n_estimators} trees; "
+                  f"using chunks of {min_rows} rows so every row is trained on")
+            chunk_rows = min_rows
+        # The trees are spread evenly over the chunks; a skipped chunk's trees go to the next one
+        n_chunks = math.ceil(n_train / chunk_rows)
+        clf.set_params(n_estimators=0, warm_start=True)
+        for i, (chunk_start, X, delay_prob) in enumerate(iter_chunks(path, chunk_rows)):
+            if chunk_start >= n_train:
+                break
+            X, y = X[:n_train - chunk_start], labels(delay_prob[:n_train - chunk_start])
+            if len(np.unique(y)) < 2:
+                print(f"rows {chunk_start}-{chunk_start + len(X)}: only one class, skipped")
+                continue
+            clf.set_params(n_estimators=(i + 1) * n_estimators // n_chunks)
+            clf.fit(X, y)
+            print(f"rows {chunk_start}-{chunk_start + len(X)}: {clf.n_estimators} trees, {time.perf_counter() - start:.1f}s")
+    else:
+        X, y = read_rows(path, 0, n_train, chunk_rows or n_train or 1)
+        clf.fit(X, y)
+        del X, y
+    train_seconds = time.perf_counter() - start
 
-# Train-test split
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    X_test, y_test = read_rows(path, n_train, n, chunk_rows or n_test or 1)
+    report = {}
+    if n_test:
+        # Evaluation
+        y_pred = clf.predict(X_test)
+        print(classification_report(y_test, y_pred, zero_division=0))
+        report = classification_report(y_test, y_pred, output_dict=True, zero_division=0)
+    stats = {
+        "rows": n,
+        "train_rows": n_train,
+        "test_rows": n_test,
+        "n_estimators": len(clf.estimators_),
+        "n_jobs": n_jobs,
+        "chunk_rows": chunk_rows,
+        "train_seconds": round(train_seconds, 2),
+        "peak_memory_mb": round(peak_memory_mb(), 1),
+        "accuracy": report.get("accuracy"),
+    }
+    return clf, stats
 
-# Model
-clf = RandomForestClassifier(n_estimators=100, random_state=42)
-clf.fit(X_train, y_train)
 
-# Evaluation
-y_pred = clf.predict(X_test)
-print(classification_report(y_test, y_pred))
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=os.path.join(MODEL_DIR, "synthetic_shipments.csv"))
+    parser.add_argument("--out", default=os.path.join(MODEL_DIR, "shipment_delay_model"),
+                        help="output path without extension; .pkl and .forest are written")
+    parser.add_argument("--n-estimators", type=int, default=100)
+    parser.add_argument("--n-jobs", type=int, default=-1, help="cores to use (-1 = all)")
+    parser.add_argument("--max-samples", type=float, default=None, help="share of rows each tree is grown on")
+    parser.add_argument("--max-depth", type=int, default=None)
+    parser.add_argument("--min-samples-leaf", type=int, default=1)
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--max-test-rows", type=int, default=1_000_000)
+    parser.add_argument("--chunk-rows", type=int, default=None, help="train chunk by chunk (warm_start)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--report", help="write the training stats as JSON to this file")
+    args = parser.parse_args()
 
+    clf, stats = train(
+        args.data, args.n_estimators, args.n_jobs, args.max_samples, args.max_depth, args.min_samples_leaf,
+        args.test_size, args.max_test_rows, args.chunk_rows, args.seed,
+    )
 
-# Save model with pickle
-with open("hackathon/cargo/model/shipment_delay_model.pkl", "wb") as f:
-    pickle.dump(clf, f)
+    # Save model with pickle
+    with open(f"{args.out}.pkl", "wb") as f:
+        pickle.dump(clf, f)
+    # Export the pickle-free artifact the risk services load (copy it next to their main.py)
+    export_forest(clf, f"{args.out}.forest")
 
-print("Model trained and saved as shipment_delay_model.pkl")
\ No newline at end of file
+    print(json.dumps(stats))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(stats, f, indent=2)
+    print(f"Model trained and saved as {args.out}.pkl and {args.out}.forest")
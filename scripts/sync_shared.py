@@ -0,0 +1,119 @@
+"""Copy the modules in shared/ into every service directory that uses them.
+
+Each agent and the orchestrator are built from their own directory, so shared
+code has to live next to each service's main.py. Run after editing shared/:
+
+    python scripts/sync_shared.py           # write the copies
+    python scripts/sync_shared.py --check   # exit 1 if any copy is stale
+"""
+import argparse
+import filecmp
+import shutil
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# shared module -> services that ship a copy of it
+TARGETS = {
+    "http_client.py": [
+        "cargosense_orchestrator",
+        "agents/2_geocode_route",
+        "agents/3_weather",
+        "agents/4_traffic",
+        "agents/6_riskmodel_randomForest",
+    ],
+    "batching.py": [
+        "agents/1_ingestion",
+        "agents/2_geocode_route",
+        "agents/3_weather",
+        "agents/4_traffic",
+        "agents/5_feature_builder",
+        "agents/6_riskmodel",
+        "agents/6_riskmodel_randomForest",
+        "agents/7_explanation",
+        "agents/8_notify",
+    ],
+    "forest.py": [
+        "model",
+        "model/hf",
+        "agents/6_riskmodel",
+        "agents/6_riskmodel_randomForest",
+    ],
+    "jsonio.py": [
+        "cargosense_orchestrator",
+        "agents/1_ingestion",
+        "agents/2_geocode_route",
+        "agents/3_weather",
+        "agents/4_traffic",
+        "agents/5_feature_builder",
+        "agents/6_riskmodel",
+        "agents/6_riskmodel_randomForest",
+        "agents/7_explanation",
+        "agents/8_notify",
+    ],
+    "metrics.py": [
+        "cargosense_orchestrator",
+        "agents/1_ingestion",
+        "agents/2_geocode_route",
+        "agents/3_weather",
+        "agents/4_traffic",
+        "agents/5_feature_builder",
+        "agents/6_riskmodel",
+        "agents/6_riskmodel_randomForest",
+        "agents/7_explanation",
+        "agents/8_notify",
+    ],
+    "polyline.py": [
+        "agents/2_geocode_route",
+        "agents/3_weather",
+        "agents/4_traffic",
+    ],
+    "prediction_cache.py": [
+        "agents/6_riskmodel",
+        "agents/6_riskmodel_randomForest",
+    ],
+    "single_flight.py": [
+        "agents/2_geocode_route",
+        "agents/3_weather",
+        "agents/4_traffic",
+    ],
+    "tracing.py": [
+        "cargosense_orchestrator",
+        "agents/1_ingestion",
+        "agents/2_geocode_route",
+        "agents/3_weather",
+        "agents/4_traffic",
+        "agents/5_feature_builder",
+        "agents/6_riskmodel",
+        "agents/6_riskmodel_randomForest",
+        "agents/7_explanation",
+        "agents/8_notify",
+    ],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--check", action="store_true", help="only report stale copies")
+    args = parser.parse_args()
+
+    stale = []
+    for module, services in TARGETS.items():
+        src = ROOT / "shared" / module
+        for service in services:
+            dst = ROOT / service / module
+            if dst.exists() and filecmp.cmp(src, dst, shallow=False):
+                continue
+            stale.append(dst.relative_to(ROOT))
+            if not args.check:
+                shutil.copyfile(src, dst)
+
+    for path in stale:
+        print(("stale: " if args.check else "updated: ") + str(path))
+    if args.check and stale:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""Pooled keep-alive HTTP client shared by the orchestrator and the agents.
+
+Each service is built from its own directory, so this module is copied into
+every service that uses it. Edit shared/http_client.py and run
+`python scripts/sync_shared.py` instead of editing the copies.
+
+Every attempt is recorded in metrics.py (latency, status, errors and calls in
+flight per upstream host). Each call is a client span in tracing.py and
+carries the current `traceparent` header to the upstream.
+"""
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import httpx
+
+import metrics
+import tracing
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+DEFAULT_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", "20"))
+RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.2"))
+# Longest Retry-After worth waiting for; a longer one returns the response instead
+MAX_RETRY_AFTER = float(os.getenv("HTTP_MAX_RETRY_AFTER", "30"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Failures where the request never reached the server, so sending it again is always safe
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+_limits = httpx.Limits(
+    max_connections=MAX_CONNECTIONS,
+    max_keepalive_connections=MAX_CONNECTIONS,
+    keepalive_expiry=60.0,
+)
+
+_client = None
+_async_client = None
+_lock = threading.Lock()
+_host_slots = {}
+_async_host_slots = {}
+
+
+def _backoff(attempt: int) -> float:
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, BACKOFF * (2 ** attempt))
+
+
+def _retry_after(resp: httpx.Response) -> float | None:
+    """Seconds the server asked us to wait (Retry-After as seconds or an HTTP date), if it said."""
+    value = resp.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _delay(attempt: int, resp: httpx.Response | None = None) -> float | None:
+    """Backoff before the next attempt, at least the server's Retry-After; None = too long, give up."""
+    delay = _backoff(attempt)
+    wait = _retry_after(resp) if resp is not None else None
+    if wait is not None:
+        if wait > MAX_RETRY_AFTER:
+            return None
+        delay = max(delay, wait)
+    return delay
+
+
+def _host(url: str) -> str:
+    return urlsplit(url).netloc
+
+
+def _record(host: str, start: float, status: int | None = None, error: Exception | None = None):
+    metrics.UPSTREAM_LATENCY.observe(time.perf_counter() - start, upstream=host, status=status or "error")
+    if error is not None:
+        metrics.UPSTREAM_ERRORS.inc(upstream=host, reason=type(error).__name__)
+    elif status >= 400:
+        metrics.UPSTREAM_ERRORS.inc(upstream=host, reason=str(status))
+
+
+def _finish(span, resp: httpx.Response):
+    span.set("status", resp.status_code)
+    if resp.status_code >= 400:
+        span.fail(f"HTTP {resp.status_code}")
+
+
+def client() -> httpx.Client:
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = httpx.Client(
+                    http2=HTTP2, limits=_limits, timeout=DEFAULT_TIMEOUT, follow_redirects=True
+                )
+    return _client
+
+
+def async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            http2=HTTP2, limits=_limits, timeout=DEFAULT_TIMEOUT, follow_redirects=True
+        )
+    return _async_client
+
+
+def _slot(host: str) -> threading.BoundedSemaphore:
+    with _lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(MAX_PER_HOST)
+        return _host_slots[host]
+
+
+def _async_slot(host: str) -> asyncio.Semaphore:
+    if host not in _async_host_slots:
+        _async_host_slots[host] = asyncio.Semaphore(MAX_PER_HOST)
+    return _async_host_slots[host]
+
+
+def request(method: str, url: str, *, timeout=None, retries=None, retry_on=httpx.TransportError,
+            retry_statuses=RETRY_STATUSES, **kwargs) -> httpx.Response:
+    """Send a request over the shared pool, retrying transport errors and 429/5xx.
+
+    The last response is returned as-is (callers check the status themselves);
+    a transport error on the final attempt is raised. For expensive requests,
+    narrow `retry_on` (e.g. CONNECT_ERRORS) and `retry_statuses` so work the
+    server may already have done is not sent again.
+    """
+    retries = RETRIES if retries is None else retries
+    timeout = DEFAULT_TIMEOUT if timeout is None else timeout
+    host = _host(url)
+    with _slot(host), tracing.span(f"{method} {host}", kind="client", url=url.split("?")[0]) as span:
+        kwargs["headers"] = {**(kwargs.get("headers") or {}), **tracing.headers()}
+        for attempt in range(retries + 1):
+            span.set("attempts", attempt + 1)
+            start = time.perf_counter()
+            resp = None
+            try:
+                with metrics.UPSTREAM_IN_FLIGHT.track(upstream=host):
+                    resp = client().request(method, url, timeout=timeout, **kwargs)
+            except httpx.TransportError as e:
+                _record(host, start, error=e)
+                if attempt == retries or not isinstance(e, retry_on):
+                    raise
+            else:
+                _record(host, start, resp.status_code)
+            delay = _delay(attempt, resp)
+            if resp is not None and (resp.status_code not in retry_statuses or attempt == retries or delay is None):
+                _finish(span, resp)
+                return resp
+            time.sleep(delay)
+
+
+async def arequest(method: str, url: str, *, timeout=None, retries=None, retry_on=httpx.TransportError,
+                   retry_statuses=RETRY_STATUSES, **kwargs) -> httpx.Response:
+    """Async counterpart of `request`."""
+    retries = RETRIES if retries is None else retries
+    timeout = DEFAULT_TIMEOUT if timeout is None else timeout
+    host = _host(url)
+    async with _async_slot(host):
+        with tracing.span(f"{method} {host}", kind="client", url=url.split("?")[0]) as span:
+            kwargs["headers"] = {**(kwargs.get("headers") or {}), **tracing.headers()}
+            for attempt in range(retries + 1):
+                span.set("attempts", attempt + 1)
+                start = time.perf_counter()
+                resp = None
+                try:
+                    with metrics.UPSTREAM_IN_FLIGHT.track(upstream=host):
+                        resp = await async_client().request(method, url, timeout=timeout, **kwargs)
+                except httpx.TransportError as e:
+                    _record(host, start, error=e)
+                    if attempt == retries or not isinstance(e, retry_on):
+                        raise
+                else:
+                    _record(host, start, resp.status_code)
+                delay = _delay(attempt, resp)
+                if resp is not None and (resp.status_code not in retry_statuses or attempt == retries or delay is None):
+                    _finish(span, resp)
+                    return resp
+                await asyncio.sleep(delay)
+
+
+def get(url: str, **kwargs) -> httpx.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> httpx.Response:
+    return request("POST", url, **kwargs)
+
+
+async def aget(url: str, **kwargs) -> httpx.Response:
+    return await arequest("GET", url, **kwargs)
+
+
+async def apost(url: str, **kwargs) -> httpx.Response:
+    return await arequest("POST", url, **kwargs)
+
+
+async def aclose():
+    """Close the pools; call from the app's shutdown hook."""
+    global _client, _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    if _client is not None:
+        _client.close()
+        _client = None
@@ -0,0 +1,105 @@
+"""Google encoded polyline format (precision 5 = ~1 m) and sampling along a route.
+
+Copied by scripts/sync_shared.py into the geocode, weather and traffic agents;
+edit shared/polyline.py.
+
+The geocode agent passes the whole TomTom route on as `route_polyline`. The
+weather and traffic agents decode it and sample points evenly spaced by
+distance along the road, so a long route is covered end to end rather than
+only around its first few hundred metres.
+"""
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+
+EARTH_RADIUS_KM = 6371.0
+SAMPLE_CACHE_SIZE = 4096
+
+# (route digest, n) -> samples. Keyed on a digest so the cache holds no route strings.
+_samples = OrderedDict()
+_samples_lock = threading.Lock()
+
+
+def encode(points, precision: int = 5) -> str:
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lon = 0
+    for lat, lon in points:
+        lat_i, lon_i = round(lat * factor), round(lon * factor)
+        for delta in (lat_i - prev_lat, lon_i - prev_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        prev_lat, prev_lon = lat_i, lon_i
+    return "".join(out)
+
+
+def decode(encoded: str, precision: int = 5) -> list[tuple[float, float]]:
+    factor = 10 ** precision
+    points = []
+    index = lat = lon = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1F) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        points.append((lat / factor, lon / factor))
+    return points
+
+
+def haversine_km(a: tuple, b: tuple) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(h)))
+
+
+def resample(points: list, n: int) -> list[tuple[float, float]]:
+    """n points spaced evenly by distance along the path, from its first point to its last."""
+    points = [(float(lat), float(lon)) for lat, lon in points]
+    if len(points) < 2 or n < 2:
+        return points[:n]
+    cumulative = [0.0]
+    for a, b in zip(points, points[1:]):
+        cumulative.append(cumulative[-1] + haversine_km(a, b))
+    total = cumulative[-1]
+    if total == 0:
+        return [points[0]] * n
+
+    samples, segment = [], 1
+    for i in range(n):
+        target = total * i / (n - 1)
+        while segment < len(points) - 1 and cumulative[segment] < target:
+            segment += 1
+        start, end = cumulative[segment - 1], cumulative[segment]
+        t = (target - start) / (end - start) if end > start else 0.0
+        (lat1, lon1), (lat2, lon2) = points[segment - 1], points[segment]
+        samples.append((lat1 + (lat2 - lat1) * t, lon1 + (lon2 - lon1) * t))
+    return samples
+
+
+def sample(encoded: str, n: int) -> tuple:
+    """`resample` of an encoded polyline; shipments on the same lane share the result."""
+    key = (hashlib.blake2b(encoded.encode(), digest_size=16).digest(), n)
+    with _samples_lock:
+        points = _samples.get(key)
+        if points is not None:
+            _samples.move_to_end(key)
+            return points
+    points = tuple(resample(decode(encoded), n))
+    with _samples_lock:
+        _samples[key] = points
+        while len(_samples) > SAMPLE_CACHE_SIZE:
+            _samples.popitem(last=False)
+    return points